@@ -88,13 +88,82 @@ WSGI_APPLICATION = "biznezz.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Write-ahead logging lets searches keep reading while a load, reload or centroid refresh writes. With the default
+# rollback journal, a write transaction that outgrows SQLite's page cache locks every reader out until it commits.
+SQLITE_INIT_COMMAND = "PRAGMA journal_mode=WAL"
+
 DATABASES = {
     "default": {
         "ENGINE": "django.contrib.gis.db.backends.spatialite",
         "NAME": BASE_DIR / "db/db.sqlite3",
+        "OPTIONS": {"init_command": SQLITE_INIT_COMMAND},
     }
 }
 
+# Optional sharded layout for the business store: one SpatiaLite file per state ("state")
+# or per group of states ("region"). Leave empty to keep everything in the default database.
+BUSINESS_SHARDING = os.environ.get("BUSINESS_SHARDING", "").strip().lower()
+
+# Maps each shard database alias to the state codes it holds. Empty when sharding is off.
+BUSINESS_SHARDS = {}
+
+if BUSINESS_SHARDING:
+    from search.constants import STATE_SHARD_GROUPS, US_STATES
+
+    if BUSINESS_SHARDING == "state":
+        shard_groups = {code.lower(): [code] for code, _ in US_STATES}
+    elif BUSINESS_SHARDING == "region":
+        shard_groups = STATE_SHARD_GROUPS
+    else:
+        raise ValueError(f"Unknown BUSINESS_SHARDING mode: {BUSINESS_SHARDING!r} (expected 'state' or 'region')")
+
+    # SQLite creates the database files but not the directory holding them
+    os.makedirs(BASE_DIR / "db" / "shards", exist_ok=True)
+    for group_name, states in shard_groups.items():
+        alias = f"shard_{group_name}"
+        DATABASES[alias] = {
+            "ENGINE": "django.contrib.gis.db.backends.spatialite",
+            "NAME": BASE_DIR / "db" / "shards" / f"{group_name}.sqlite3",
+            "OPTIONS": {"init_command": SQLITE_INIT_COMMAND},
+        }
+        BUSINESS_SHARDS[alias] = list(states)
+
+    DATABASE_ROUTERS = ["search.routers.BusinessShardRouter"]
+
+# Size of the worker pool shared by fanned out radius searches (each worker keeps a connection per shard it queried).
+BUSINESS_SHARD_WORKERS = int(os.environ.get("BUSINESS_SHARD_WORKERS", "8"))
+
+# Number of nearest businesses precomputed for each city centroid (see search/centroids.py).
+CITY_NEAREST_K = int(os.environ.get("CITY_NEAREST_K", "25"))
+
+# How long a search waits for an identical in-flight search to finish before giving up (see search/singleflight.py).
+SEARCH_COALESCE_TIMEOUT_SECONDS = float(os.environ.get("SEARCH_COALESCE_TIMEOUT_SECONDS", "30"))
+
+# Geohash resolutions (cell id lengths) the loader precomputes business counts for, and the breakdowns
+# kept on top of the totals (see search/density.py).
+DENSITY_RESOLUTIONS = [int(r) for r in os.environ.get("DENSITY_RESOLUTIONS", "2,3,4,5,6").split(",") if r.strip()]
+DENSITY_BREAKDOWNS = [b.strip() for b in os.environ.get("DENSITY_BREAKDOWNS", "state,city").split(",") if b.strip()]
+# Max number of cells a single /heatmap response returns
+HEATMAP_MAX_CELLS = int(os.environ.get("HEATMAP_MAX_CELLS", "5000"))
+
+# Admission control for the search path (see search/admission.py). Radius searches are the expensive ones,
+# so they get a separate, smaller concurrency limit than city/state lookups.
+SEARCH_MAX_CONCURRENT_RADIUS = int(os.environ.get("SEARCH_MAX_CONCURRENT_RADIUS", "4"))
+SEARCH_MAX_CONCURRENT_CITY_STATE = int(os.environ.get("SEARCH_MAX_CONCURRENT_CITY_STATE", "16"))
+# Searches waiting for a slot beyond these get a 429 right away
+SEARCH_MAX_QUEUED_RADIUS = int(os.environ.get("SEARCH_MAX_QUEUED_RADIUS", "16"))
+SEARCH_MAX_QUEUED_CITY_STATE = int(os.environ.get("SEARCH_MAX_QUEUED_CITY_STATE", "64"))
+# Searches waiting longer than this for a slot get a 503
+SEARCH_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("SEARCH_QUEUE_TIMEOUT_SECONDS", "2"))
+SEARCH_RETRY_AFTER_SECONDS = int(os.environ.get("SEARCH_RETRY_AFTER_SECONDS", "2"))
+
+# Per-query work budget for radius searches. The incremental walk tries up to 7 radii (the query radius, then one
+# per RADIUS_INCREMENTS_KM step), so the default walks all of them. Setting SEARCH_MAX_EXPANSIONS=3 caps the walk
+# early; a search with nothing within the first 3 radii then comes back empty and partial.
+SEARCH_MAX_EXPANSIONS = int(os.environ.get("SEARCH_MAX_EXPANSIONS", "7"))
+SEARCH_MAX_ROWS = int(os.environ.get("SEARCH_MAX_ROWS", "1000"))
+SEARCH_DEADLINE_SECONDS = float(os.environ.get("SEARCH_DEADLINE_SECONDS", "5"))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
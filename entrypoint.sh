@@ -7,6 +7,13 @@ set -e
 # Apply database migrations
 python manage.py migrate --noinput
 
+# Migrate the business shards as well when the sharded layout is on
+if [ -n "$BUSINESS_SHARDING" ]; then
+    for alias in $(python manage.py shell -c "from django.conf import settings; print(' '.join(settings.BUSINESS_SHARDS))"); do
+        python manage.py migrate --noinput --database "$alias"
+    done
+fi
+
 # Load businesses data
 python manage.py load_businesses --clear
 
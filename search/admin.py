@@ -1,7 +1,180 @@
+from django.contrib import messages
 from django.contrib.gis import admin
+from django.core.paginator import Paginator
+from django.db import OperationalError, connections
+from django.db.models import F, FloatField, Func, Max
+from django.utils.functional import cached_property
+
+from search import centroids, density, sharding
 from search.models import Business
+from typing import List
+
+# Past this many matches, a filtered changelist stops counting and just shows this many pages' worth
+MAX_COUNTED_ROWS = 10000
+
+# Upper bound of the code points, so [term, term + this) is every string starting with term
+MAX_CHAR = "\U0010ffff"
+
+# Bigger bulk deletes are refused, the materialized tables couldn't be refreshed incrementally within the request.
+# Reload the dataset (load_businesses --swap) instead.
+MAX_DELETED_ROWS = 1000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never runs an exact COUNT(*) over the whole table.
+
+    The unfiltered count comes from the table statistics (`ANALYZE`), or the largest id when there are none.
+    Filtered counts stop at MAX_COUNTED_ROWS.
+    """
+
+    @cached_property
+    def count(self) -> int:
+        queryset = self.object_list
+        if queryset.query.has_filters():
+            # COUNT(*) over a LIMITed subquery, so a broad filter costs at most MAX_COUNTED_ROWS rows
+            return queryset.order_by()[:MAX_COUNTED_ROWS].count()
+
+        connection = connections[queryset.db]
+        try:
+            with connection.cursor() as cursor:
+                # The first number of every sqlite_stat1 row of a table is its row count
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row:
+                return int(row[0].split()[0])
+        except OperationalError:
+            # No sqlite_stat1 until ANALYZE ran once
+            pass
+        return queryset.order_by().aggregate(max_id=Max("id"))["max_id"] or 0
+
+
+class CityListFilter(admin.SimpleListFilter):
+    """
+    Cities of the selected state. Only offered once a state is picked, so listing the choices stays an indexed
+    read of one state instead of a scan for every distinct city.
+    """
+    title = "city"
+    parameter_name = "city"
+
+    def lookups(self, request, model_admin):
+        state = request.GET.get("state__exact")
+        if not state:
+            return ()
+        cities = Business.objects.filter(state=state).order_by("city").values_list("city", flat=True).distinct()
+        return [(city, city) for city in cities if city]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(city=self.value())
+        return queryset
 
 
 @admin.register(Business)
 class BusinessAdmin(admin.GISModelAdmin):
-    list_display = ("name", "city", "state", "location")
\ No newline at end of file
+    """
+    Changelist tuned for millions of rows: estimated counts, indexed filters and search, plain coordinates instead
+    of geometry in the list, and a bulk delete that runs as a single statement.
+
+    Admin queries aren't routed to the shards, so businesses can't be managed here once the store is sharded.
+    Every add, change and delete refreshes the materialized centroid and density tables for the points it touched.
+    """
+    list_display = ("name", "city", "state", "longitude", "latitude")
+    list_filter = ("state", CityListFilter)
+    search_fields = ("name",)
+    search_help_text = "Businesses whose name starts with the search term (case-sensitive)."
+    paginator = EstimatedCountPaginator
+    # Skip the second, unfiltered count behind "N total"
+    show_full_result_count = False
+    actions = ("delete_selected_businesses",)
+
+    def get_queryset(self, request):
+        # The list only needs the coordinates, not the geometry itself
+        return super().get_queryset(request).defer("location").annotate(
+            longitude=Func(F("location"), function="ST_X", output_field=FloatField()),
+            latitude=Func(F("location"), function="ST_Y", output_field=FloatField()),
+        )
+
+    def get_search_results(self, request, queryset, search_term):
+        # A range on name uses business_name_idx, unlike the LIKE '%term%' the default search runs
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return queryset.filter(name__gte=search_term, name__lt=search_term + MAX_CHAR), False
+
+    def has_module_permission(self, request):
+        return not sharding.is_sharded() and super().has_module_permission(request)
+
+    def has_view_permission(self, request, obj=None):
+        return not sharding.is_sharded() and super().has_view_permission(request, obj)
+
+    def has_add_permission(self, request):
+        return not sharding.is_sharded() and super().has_add_permission(request)
+
+    def has_change_permission(self, request, obj=None):
+        return not sharding.is_sharded() and super().has_change_permission(request, obj)
+
+    def has_delete_permission(self, request, obj=None):
+        return not sharding.is_sharded() and super().has_delete_permission(request, obj)
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        # Collects and deletes one object at a time, and lists every one of them on its confirmation page
+        actions.pop("delete_selected", None)
+        return actions
+
+    def save_model(self, request, obj, form, change):
+        # Where the business was before the change, so the materialized tables can drop it from there
+        removed = [
+            (location.y, location.x, city, state)
+            for location, city, state in Business.objects.filter(pk=obj.pk).values_list("location", "city", "state")
+        ] if change else []
+        super().save_model(request, obj, form, change)
+        added = [(obj.location.y, obj.location.x, obj.city, obj.state)]
+        if added != removed:
+            self._refresh_materialized_tables(added, removed)
+
+    def delete_model(self, request, obj):
+        removed = [(obj.location.y, obj.location.x, obj.city, obj.state)]
+        super().delete_model(request, obj)
+        self._refresh_materialized_tables([], removed)
+
+    @staticmethod
+    def _refresh_materialized_tables(added: List[density.BusinessPoint], removed: List[density.BusinessPoint]) -> None:
+        """
+        Incrementally update the centroid and density tables after businesses were added at or removed from
+        the given (lat, lon, city, state) points.
+        """
+        points = added + removed
+        centroids.refresh_city_centroids(
+            {(city, state) for _, _, city, state in points},
+            [(lat, lon) for lat, lon, _, _ in points],
+        )
+        density.refresh_density_cells(added=added, removed=removed)
+
+    def longitude(self, business):
+        return round(business.longitude, 6)
+
+    def latitude(self, business):
+        return round(business.latitude, 6)
+
+    @admin.action(permissions=["delete"], description="Delete selected businesses")
+    def delete_selected_businesses(self, request, queryset):
+        # Small enough for an incremental centroid refresh, never a full rebuild within the request
+        max_rows = min(MAX_DELETED_ROWS, centroids.max_incremental_locations())
+        if queryset.order_by()[:max_rows + 1].count() > max_rows:
+            self.message_user(
+                request,
+                f"Select at most {max_rows} businesses to delete at once. "
+                f"Reload the dataset with `load_businesses --swap` for bigger changes.",
+                messages.ERROR,
+            )
+            return
+
+        # Needed to update the materialized tables once the rows are gone
+        deleted_points = list(queryset.order_by().values_list("latitude", "longitude", "city", "state"))
+        # Nothing cascades from Business, so this is a single DELETE ... WHERE statement
+        deleted_count, _ = queryset.delete()
+
+        self._refresh_materialized_tables([], deleted_points)
+        self.message_user(request, f"Deleted {deleted_count} businesses.", messages.SUCCESS)
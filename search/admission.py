@@ -0,0 +1,206 @@
+"""
+Admission control and per-query work budgets for the search path.
+
+Radius searches can get expensive (several spheroid distance scans over the business table), so they get their
+own concurrency limit, separate from the cheap city/state lookups, and every radius walk runs within a budget.
+Instead of queueing without bound, callers get an Overloaded error carrying a status code and a Retry-After.
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass
+import functools
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from typing import Dict, Iterator, Optional
+
+# Work classes with their own concurrency limits
+RADIUS = "radius"
+CITY_STATE = "city_state"
+
+# How many SQLite VM instructions run between deadline checks
+DEADLINE_CHECK_INSTRUCTIONS = 10000
+
+
+class Overloaded(Exception):
+    """
+    Raised when a search can't be admitted. Carries the HTTP status and Retry-After to answer with.
+    """
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class SearchBudget:
+    """
+    Limits on the work a single radius search may do. None means unlimited.
+    Frozen (and so hashable) so identical searches with the same budget still coalesce.
+
+    Attributes:
+        max_expansions: Max number of radii tried by the incremental search
+        max_rows: Max number of businesses returned (the nearest ones are kept)
+        deadline_seconds: Wall-clock time the whole search may take
+    """
+    max_expansions: Optional[int] = None
+    max_rows: Optional[int] = None
+    deadline_seconds: Optional[float] = None
+
+    @classmethod
+    def from_settings(cls) -> "SearchBudget":
+        return cls(
+            max_expansions=settings.SEARCH_MAX_EXPANSIONS,
+            max_rows=settings.SEARCH_MAX_ROWS,
+            deadline_seconds=settings.SEARCH_DEADLINE_SECONDS,
+        )
+
+    def deadline(self) -> Optional[float]:
+        """
+        Returns:
+            Optional[float]: time.monotonic() value the search must finish by, counting from now, or None
+        """
+        return None if self.deadline_seconds is None else time.monotonic() + self.deadline_seconds
+
+
+@contextmanager
+def query_deadline(deadline: Optional[float], using: str = DEFAULT_DB_ALIAS) -> Iterator[None]:
+    """
+    Interrupt SQLite queries on a connection once a deadline passes. The interrupted query raises
+    django.db.OperationalError.
+
+    Args:
+        deadline: time.monotonic() value to stop at, or None for no deadline
+        using: Database alias whose (current thread's) connection to watch
+    """
+    if deadline is None:
+        yield
+        return
+
+    connection = connections[using]
+    connection.ensure_connection()
+    raw_connection = connection.connection
+    # A non-zero return from the progress handler makes SQLite abort the running statement
+    raw_connection.set_progress_handler(lambda: int(time.monotonic() >= deadline), DEADLINE_CHECK_INSTRUCTIONS)
+    try:
+        yield
+    finally:
+        raw_connection.set_progress_handler(None, 0)
+
+
+class AdmissionController:
+    """
+    Bounded concurrency per work class, with a bounded wait queue in front of it.
+
+    A search that finds the queue for its class full is rejected right away with a 429. One that waits
+    longer than queue_timeout for a slot is rejected with a 503. Both carry a Retry-After.
+
+    Attributes:
+        limits: Max concurrent searches per work class
+        max_queued: Max searches waiting for a slot per work class
+        queue_timeout: Seconds a search waits for a slot before giving up
+        retry_after: Seconds clients are told to wait before retrying
+    """
+
+    def __init__(self, limits: Dict[str, int], max_queued: Dict[str, int], queue_timeout: float, retry_after: int):
+        self.limits = dict(limits)
+        self.max_queued = dict(max_queued)
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._semaphores = {work_class: threading.BoundedSemaphore(limit) for work_class, limit in limits.items()}
+        self._lock = threading.Lock()
+        self._queued = {work_class: 0 for work_class in limits}
+        self._stats = {work_class: {"admitted": 0, "rejected_queue_full": 0, "rejected_timeout": 0} for work_class in limits}
+
+    @classmethod
+    def from_settings(cls) -> "AdmissionController":
+        return cls(
+            limits={RADIUS: settings.SEARCH_MAX_CONCURRENT_RADIUS, CITY_STATE: settings.SEARCH_MAX_CONCURRENT_CITY_STATE},
+            max_queued={RADIUS: settings.SEARCH_MAX_QUEUED_RADIUS, CITY_STATE: settings.SEARCH_MAX_QUEUED_CITY_STATE},
+            queue_timeout=settings.SEARCH_QUEUE_TIMEOUT_SECONDS,
+            retry_after=settings.SEARCH_RETRY_AFTER_SECONDS,
+        )
+
+    @contextmanager
+    def admit(self, work_class: str) -> Iterator[None]:
+        """
+        Hold a slot for the given work class while the block runs.
+
+        Args:
+            work_class: RADIUS or CITY_STATE
+
+        Raises:
+            Overloaded: If the queue is full (429) or no slot freed up in time (503)
+        """
+        semaphore = self._semaphores[work_class]
+        # Fast path, a free slot means no queueing at all
+        if not semaphore.acquire(blocking=False):
+            with self._lock:
+                if self._queued[work_class] >= self.max_queued[work_class]:
+                    self._stats[work_class]["rejected_queue_full"] += 1
+                    raise Overloaded(f"Too many {work_class} searches queued", 429, self.retry_after)
+                self._queued[work_class] += 1
+            try:
+                acquired = semaphore.acquire(timeout=self.queue_timeout)
+            finally:
+                with self._lock:
+                    self._queued[work_class] -= 1
+            if not acquired:
+                with self._lock:
+                    self._stats[work_class]["rejected_timeout"] += 1
+                raise Overloaded(f"Timed out waiting for a free {work_class} search slot", 503, self.retry_after)
+
+        with self._lock:
+            self._stats[work_class]["admitted"] += 1
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Returns:
+            Dict[str, Dict[str, int]]: Per work class counters, plus how many searches are queued right now
+        """
+        with self._lock:
+            return {
+                work_class: dict(counters, queued=self._queued[work_class])
+                for work_class, counters in self._stats.items()
+            }
+
+
+class AdmittedSearcher:
+    """
+    Wraps a BusinessSearcher so every search holds a slot of its work class while it runs.
+    """
+    WORK_CLASSES = {
+        "find_businesses_incrementally": RADIUS,
+        "find_businesses_incrementally_within_budget": RADIUS,
+        "find_businesses_in_polygon": RADIUS,
+        "find_businesses_along_route": RADIUS,
+        "find_businesses_in_polygon_within_budget": RADIUS,
+        "find_businesses_along_route_within_budget": RADIUS,
+        "find_businesses_combined": RADIUS,
+        "find_businesses_by_location": CITY_STATE,
+        "get_businesses_by_city_state": CITY_STATE,
+        "find_businesses_near_city_center": CITY_STATE,
+    }
+
+    def __init__(self, searcher, admission: AdmissionController):
+        self.searcher = searcher
+        self.admission = admission
+
+    def __getattr__(self, name: str):
+        method = getattr(self.searcher, name)
+        work_class = self.WORK_CLASSES.get(name)
+        if work_class is None:
+            return method
+
+        @functools.wraps(method)
+        def admitted(*args, **kwargs):
+            with self.admission.admit(work_class):
+                return method(*args, **kwargs)
+        return admitted
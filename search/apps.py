@@ -1,6 +1,27 @@
 from django.apps import AppConfig
+from django.db.models.signals import pre_migrate
 
 
 class SearchConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "search"
+
+    def ready(self):
+        pre_migrate.connect(restore_business_index_names, sender=self)
+
+
+def restore_business_index_names(sender, using, apps, **kwargs):
+    """
+    Swapped in business tables keep their shadow derived index names (see search/reload.py).
+    Give them back the names migrations refer to before migrating.
+    """
+    from search import reload, sharding
+
+    if using not in sharding.business_aliases():
+        return
+    try:
+        model = apps.get_model("search", "Business")
+    except LookupError:
+        # Before the migration creating it
+        return
+    reload.restore_index_names(using, model)
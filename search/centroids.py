@@ -0,0 +1,330 @@
+"""
+Materialized "nearest businesses to the center of <city>" tables.
+
+The loader computes a centroid per distinct (city, state) from the Business rows and stores the k nearest businesses
+(settings.CITY_NEAREST_K) with their distances. "Near the center of <city>" and radius searches centered on a known
+centroid then become a single indexed read instead of a distance sort over the whole business table.
+Rebuild fully (refresh_city_centroids()) after changing CITY_NEAREST_K.
+
+Radius searches trust these tables, so every write to the business table has to refresh them: the loader
+(load_businesses), the zero-downtime reload (search/reload.py) and the admin (search/admin.py) do. There's no
+post_save/post_delete hook on purpose: with a receiver connected, every queryset.delete() would fetch and
+signal row by row instead of running one DELETE statement. New write paths must call refresh_city_centroids().
+"""
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.gis.db.models import Collect
+from django.contrib.gis.db.models.functions import Distance
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D
+from django.db import transaction
+from django.db.models import Count, Max
+
+from search import sharding
+from search.geodesic import circle_bbox, spherical_distance_m
+from search.models import Business, CityCentroid, CityNearestBusiness
+from search.spatial_index import bbox_filter
+from typing import Iterable, List, Optional, Set, Tuple, Union
+
+# A radius search is considered centered on a city centroid when it's within this many degrees of it (~10 cm)
+CENTROID_MATCH_DEGREES = 1e-6
+
+# Every process keeps the centroid coordinates in memory, so the searches that aren't centered on a centroid (nearly
+# all of them) skip the lookup query. Refreshes in this process update them right away, refreshes in other processes
+# show up within this many seconds. Until then a stale copy only costs a lookup query or a trip down the live query
+# path, never a wrong answer.
+CENTROID_HINT_TTL_SECONDS = 60
+
+_hint_lock = threading.Lock()
+_hint: Optional[Set[Tuple[int, int]]] = None
+_hint_expires_at = 0.0
+
+# Default of the `centroid` arguments below: look the centroid up with centroid_at()
+LOOK_UP = object()
+
+# The k nearest businesses of a centroid are looked for within this radius first, doubling it until k are found.
+# Past NEAREST_WINDOW_MAX_KM (half the earth's circumference) the window covers everything.
+NEAREST_WINDOW_START_KM = 5
+NEAREST_WINDOW_MAX_KM = 20038
+
+# Incremental refreshes compare every changed location with every centroid.
+# Past this many comparisons a full rebuild is cheaper.
+MAX_INCREMENTAL_COMPARISONS = 5_000_000
+
+# Stored distances come from SpatiaLite, the incremental check uses python's spherical distance.
+# Pad the comparison so the two disagreeing slightly never skips a centroid that needs a rebuild.
+DISTANCE_SLACK = 1.005
+
+
+def is_enabled() -> bool:
+    # The materialized tables live on the default database next to the businesses they point at,
+    # so they're only maintained when the business store isn't sharded.
+    return not sharding.is_sharded()
+
+
+def _rebuild_city(city: str, state: str, k: int) -> Optional[CityCentroid]:
+    """
+    Recompute the centroid and nearest businesses for one city, or drop them if the city has no businesses left.
+    """
+    aggregate = Business.objects.filter(city=city, state=state).aggregate(points=Collect("location"), count=Count("id"))
+    if not aggregate["count"]:
+        CityCentroid.objects.filter(city=city, state=state).delete()
+        return None
+
+    location = aggregate["points"].centroid
+    location.srid = 4326
+    centroid, _ = CityCentroid.objects.update_or_create(
+        city=city,
+        state=state,
+        defaults={"location": location, "business_count": aggregate["count"]},
+    )
+
+    nearest = _nearest_businesses(location, k)
+    centroid.nearest.all().delete()
+    CityNearestBusiness.objects.bulk_create([
+        CityNearestBusiness(centroid=centroid, business=business, rank=rank, distance_meters=business.distance_meters.m)
+        for rank, business in enumerate(nearest, start=1)
+    ])
+    return centroid
+
+
+def _nearest_businesses(location: Point, k: int) -> List[Business]:
+    """
+    The k businesses nearest to a point, each with `distance_meters` set.
+
+    Searches a window around the point through the spatial index, doubling it until it holds k businesses within
+    its inscribed circle (anything outside the circle is farther away than those), so the cost depends on how
+    dense the area is rather than on the size of the whole table.
+    """
+    radius_km = NEAREST_WINDOW_START_KM
+    while True:
+        businesses = bbox_filter(Business.objects.all(), circle_bbox(location.y, location.x, radius_km))
+        if radius_km < NEAREST_WINDOW_MAX_KM:
+            businesses = businesses.filter(location__distance_lte=(location, D(km=radius_km)))
+        nearest = list(businesses.annotate(
+            distance_meters=Distance("location", location)
+        ).order_by("distance_meters", "id")[:k])
+        if len(nearest) == k or radius_km >= NEAREST_WINDOW_MAX_KM:
+            return nearest
+        radius_km *= 2
+
+
+def max_incremental_locations() -> int:
+    """
+    Returns:
+        int: Max number of changed locations refresh_city_centroids() handles incrementally. Past it, it rebuilds
+            everything.
+    """
+    return MAX_INCREMENTAL_COMPARISONS // max(1, CityCentroid.objects.count())
+
+
+def _cities_affected_by(locations: List[Tuple[float, float]], k: int) -> Optional[Set[Tuple[str, str]]]:
+    """
+    Cities whose nearest list may change because a business appeared at (or disappeared from) one of the locations.
+
+    Args:
+        locations: (lat, lon) of added or removed businesses
+        k: Number of nearest businesses kept per centroid
+
+    Returns:
+        Optional[Set[Tuple[str, str]]]: (city, state) pairs to rebuild, or None if a full rebuild is cheaper
+    """
+    centroids = CityCentroid.objects.annotate(kth_distance=Max("nearest__distance_meters"), nearest_count=Count("nearest"))
+    if len(locations) > max_incremental_locations():
+        return None
+
+    affected = set()
+    for centroid in centroids:
+        if centroid.nearest_count < k:
+            # Not full yet, so any new business belongs in the list
+            affected.add((centroid.city, centroid.state))
+            continue
+        cutoff = centroid.kth_distance * DISTANCE_SLACK
+        for lat, lon in locations:
+            if spherical_distance_m(centroid.location.y, centroid.location.x, lat, lon) <= cutoff:
+                affected.add((centroid.city, centroid.state))
+                break
+    return affected
+
+
+def refresh_city_centroids(
+        changed_cities: Optional[Iterable[Tuple[str, str]]] = None,
+        changed_locations: Iterable[Tuple[float, float]] = (),
+) -> int:
+    """
+    Bring the materialized centroid tables up to date.
+
+    Without arguments everything is rebuilt. Otherwise only the changed cities are rebuilt, plus any city whose
+    nearest list could be affected by a business added or removed at one of the changed locations.
+
+    Args:
+        changed_cities: (city, state) pairs that had businesses added or removed. None rebuilds everything.
+        changed_locations: (lat, lon) of the businesses that were added or removed
+
+    Returns:
+        int: Number of cities rebuilt
+    """
+    if not is_enabled():
+        return 0
+
+    k = settings.CITY_NEAREST_K
+    with transaction.atomic():
+        targets = None
+        if changed_cities is not None:
+            affected = _cities_affected_by(list(changed_locations), k)
+            if affected is not None:
+                targets = set(changed_cities) | affected
+
+        if targets is None:
+            clear_city_centroids()
+            # Clear the default ordering, otherwise `name` ends up in the SELECT DISTINCT
+            targets = set(Business.objects.order_by().values_list("city", "state").distinct())
+
+        for city, state in sorted(targets):
+            _rebuild_city(city, state, k)
+    invalidate_centroid_hint()
+    return len(targets)
+
+
+def clear_city_centroids() -> None:
+    """
+    Drop every materialized centroid, e.g. when the business ids they point at are about to change.
+    Searches fall back to the live queries until refresh_city_centroids() runs.
+    """
+    CityNearestBusiness.objects.all().delete()
+    CityCentroid.objects.all().delete()
+    invalidate_centroid_hint()
+
+
+def invalidate_centroid_hint() -> None:
+    """
+    Make the next lookup re-read the in-memory centroid coordinates from the table.
+    """
+    global _hint
+    with _hint_lock:
+        _hint = None
+
+
+def _hint_cell(lat: float, lon: float) -> Tuple[int, int]:
+    return math.floor(lon / CENTROID_MATCH_DEGREES), math.floor(lat / CENTROID_MATCH_DEGREES)
+
+
+def _may_be_centroid(lat: float, lon: float) -> bool:
+    """
+    Whether a point is within CENTROID_MATCH_DEGREES of a centroid according to the in-memory coordinates,
+    re-reading them from the table once they're older than CENTROID_HINT_TTL_SECONDS.
+    """
+    global _hint, _hint_expires_at
+    with _hint_lock:
+        if _hint is None or time.monotonic() >= _hint_expires_at:
+            _hint = {_hint_cell(location.y, location.x) for location in CityCentroid.objects.values_list("location", flat=True)}
+            _hint_expires_at = time.monotonic() + CENTROID_HINT_TTL_SECONDS
+        hint = _hint
+
+    # A point within CENTROID_MATCH_DEGREES of a centroid falls in its cell or in one next to it
+    x, y = _hint_cell(lat, lon)
+    return any((x + dx, y + dy) in hint for dx in (-1, 0, 1) for dy in (-1, 0, 1))
+
+
+def nearest_to_city_center(city: str, state: str) -> Tuple[Optional[CityCentroid], List[Business]]:
+    """
+    Read the precomputed nearest businesses for a city's centroid.
+
+    Args:
+        city: City name (exact match, like the data is stored)
+        state: State code (exact match, e.g., 'CA' for California)
+
+    Returns:
+        Tuple[Optional[CityCentroid], List[Business]]: The centroid (None if not materialized) and its nearest
+            businesses, nearest first, each with `distance_meters` set
+    """
+    if not is_enabled():
+        return None, []
+    centroid = CityCentroid.objects.filter(city=city, state=state).first()
+    if centroid is None:
+        return None, []
+    return centroid, _businesses(centroid.nearest.select_related("business"))
+
+
+def centroid_at(lat: float, lon: float) -> Optional[CityCentroid]:
+    """
+    The materialized centroid at a point, if it has any nearest businesses. Look it up once and pass it to
+    businesses_within_radius_of_centroid() when answering several radii around the same point.
+
+    Args:
+        lat: Latitude (WGS84)
+        lon: Longitude (WGS84)
+
+    Returns:
+        Optional[CityCentroid]: The centroid, with `kth_distance` and `nearest_count` set, or None
+    """
+    if not is_enabled() or not _may_be_centroid(lat, lon):
+        return None
+
+    bbox = (lon - CENTROID_MATCH_DEGREES, lat - CENTROID_MATCH_DEGREES, lon + CENTROID_MATCH_DEGREES, lat + CENTROID_MATCH_DEGREES)
+    centroid = bbox_filter(CityCentroid.objects.all(), bbox).annotate(
+        kth_distance=Max("nearest__distance_meters"), nearest_count=Count("nearest")
+    ).first()
+    if centroid is None or not centroid.nearest_count:
+        return None
+    return centroid
+
+
+def is_centroid(lat: float, lon: float) -> bool:
+    """
+    Whether a point is a known city centroid, i.e. whether businesses_within_radius_of_centroid() can answer radius
+    searches centered on it (up to the centroid's k-th nearest distance). Runs no query unless the point is next to
+    a centroid's coordinates.
+
+    Args:
+        lat: Latitude (WGS84)
+        lon: Longitude (WGS84)
+
+    Returns:
+        bool: True if radius searches centered on the point can read the materialized table
+    """
+    return centroid_at(lat, lon) is not None
+
+
+def businesses_within_radius_of_centroid(
+        lat: float,
+        lon: float,
+        radius_km: float,
+        centroid: Union[CityCentroid, None, object] = LOOK_UP,
+) -> Optional[List[Business]]:
+    """
+    Answer a radius search from the materialized table when it's centered on a known city centroid.
+
+    The table holds every business within the k-th nearest distance of the centroid, so it can answer any radius up
+    to that distance (or any radius at all when there are fewer than k businesses).
+
+    Args:
+        lat: Center point latitude (WGS84)
+        lon: Center point longitude (WGS84)
+        radius_km: Search radius in kilometers
+        centroid: centroid_at(lat, lon), if already looked up
+
+    Returns:
+        Optional[List[Business]]: Businesses within the radius, nearest first, or None if the table can't answer
+    """
+    if centroid is LOOK_UP:
+        centroid = centroid_at(lat, lon)
+    if centroid is None:
+        return None
+
+    radius_meters = radius_km * 1000
+    if centroid.nearest_count >= settings.CITY_NEAREST_K and radius_meters > centroid.kth_distance:
+        return None
+    return _businesses(centroid.nearest.filter(distance_meters__lte=radius_meters).select_related("business"))
+
+
+def _businesses(rows: Iterable[CityNearestBusiness]) -> List[Business]:
+    businesses = []
+    for row in rows:
+        business = row.business
+        business.distance_meters = D(m=row.distance_meters)
+        businesses.append(business)
+    return businesses
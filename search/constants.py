@@ -53,3 +53,18 @@ US_STATES = [
 ]
 
 RADIUS_INCREMENTS_KM = [1, 5, 10, 25, 50, 100]
+
+# State groups used when the business store is sharded by region (BUSINESS_SHARDING=region).
+# Roughly the US census divisions, with the non-contiguous states kept in their own group.
+STATE_SHARD_GROUPS = {
+	"new_england": ["CT", "ME", "MA", "NH", "RI", "VT"],
+	"mid_atlantic": ["NJ", "NY", "PA"],
+	"east_north_central": ["IL", "IN", "MI", "OH", "WI"],
+	"west_north_central": ["IA", "KS", "MN", "MO", "NE", "ND", "SD"],
+	"south_atlantic": ["DE", "DC", "FL", "GA", "MD", "NC", "SC", "VA", "WV"],
+	"east_south_central": ["AL", "KY", "MS", "TN"],
+	"west_south_central": ["AR", "LA", "OK", "TX"],
+	"mountain": ["AZ", "CO", "ID", "MT", "NV", "NM", "UT", "WY"],
+	"pacific": ["CA", "OR", "WA"],
+	"non_contiguous": ["AK", "HI"],
+}
@@ -0,0 +1,141 @@
+"""
+Precomputed business density per geohash cell, at several resolutions.
+
+The loader counts businesses per cell for every resolution in settings.DENSITY_RESOLUTIONS, with optional per-state
+and per-city breakdowns (settings.DENSITY_BREAKDOWNS). The /heatmap endpoint reads these counts for the cells
+intersecting a bounding box, so low zoom map views never have to touch the business table.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q, QuerySet
+
+from search import geohash, sharding
+from search.geodesic import BBox
+from search.models import Business, DensityCell
+from typing import Iterable, Iterator, Optional, Tuple
+
+# (resolution, cell, state, city). Empty state/city mean "not broken down".
+CellKey = Tuple[int, str, str, str]
+
+# (lat, lon, city, state) of a business
+BusinessPoint = Tuple[float, float, str, str]
+
+
+def _cell_keys(lat: float, lon: float, city: str, state: str) -> Iterator[CellKey]:
+    breakdowns = settings.DENSITY_BREAKDOWNS
+    for resolution in settings.DENSITY_RESOLUTIONS:
+        cell = geohash.encode(lat, lon, resolution)
+        yield resolution, cell, "", ""
+        # Without a state (or city) the breakdown row would just duplicate the one above it
+        if state and "state" in breakdowns:
+            yield resolution, cell, state, ""
+        if state and city and "city" in breakdowns:
+            yield resolution, cell, state, city
+
+
+def _count(points: Iterable[BusinessPoint], delta: int = 1) -> Counter:
+    counts = Counter()
+    for lat, lon, city, state in points:
+        for key in _cell_keys(lat, lon, city, state):
+            counts[key] += delta
+    return counts
+
+
+def _all_business_points() -> Iterator[BusinessPoint]:
+    for alias in sharding.business_aliases():
+        # Clear the default ordering, there's no need to sort the whole table
+        rows = Business.objects.using(alias).order_by().values_list("location", "city", "state")
+        for location, city, state in rows.iterator(chunk_size=2000):
+            yield location.y, location.x, city, state
+
+
+def _new_cell(key: CellKey, count: int) -> DensityCell:
+    resolution, cell, state, city = key
+    south, west, north, east = geohash.bounds(cell)
+    return DensityCell(
+        resolution=resolution, cell=cell, state=state, city=city, count=count,
+        south=south, west=west, north=north, east=east,
+    )
+
+
+def refresh_density_cells(
+        added: Optional[Iterable[BusinessPoint]] = None,
+        removed: Iterable[BusinessPoint] = (),
+) -> int:
+    """
+    Bring the density cells up to date.
+
+    Without arguments every count is recomputed from the business table(s). Otherwise the counts of the
+    cells holding the added and removed businesses are adjusted in place.
+
+    Args:
+        added: (lat, lon, city, state) of businesses that were added. None recomputes everything.
+        removed: (lat, lon, city, state) of businesses that were removed
+
+    Returns:
+        int: Number of cells written
+    """
+    with transaction.atomic():
+        if added is None:
+            counts = _count(_all_business_points())
+            DensityCell.objects.all().delete()
+            DensityCell.objects.bulk_create((_new_cell(key, count) for key, count in counts.items()), batch_size=2000)
+            return len(counts)
+
+        deltas = _count(added)
+        deltas.update(_count(removed, delta=-1))
+        written = 0
+        for key, delta in deltas.items():
+            if not delta:
+                continue
+            resolution, cell, state, city = key
+            updated = DensityCell.objects.filter(
+                resolution=resolution, cell=cell, state=state, city=city
+            ).update(count=F("count") + delta)
+            if not updated and delta > 0:
+                _new_cell(key, delta).save()
+            written += 1
+        DensityCell.objects.filter(count__lte=0).delete()
+        return written
+
+
+def cells_in_bbox(bbox: BBox, resolution: int, state: Optional[str] = None, city: Optional[str] = None) -> QuerySet:
+    """
+    Density cells intersecting a bounding box.
+
+    Args:
+        bbox: (min_lon, min_lat, max_lon, max_lat). A box crossing the antimeridian has min_lon > max_lon.
+        resolution: Geohash resolution, one of settings.DENSITY_RESOLUTIONS
+        state: Only count businesses in this state
+        city: Only count businesses in this city (needs a state)
+
+    Returns:
+        QuerySet[DensityCell]: The cells, in geohash order
+
+    Raises:
+        ValueError: If min_lat > max_lat
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if min_lat > max_lat:
+        raise ValueError(f"bbox min_lat {min_lat} is greater than its max_lat {max_lat}")
+
+    if min_lon <= max_lon:
+        longitudes = Q(west__lte=max_lon, east__gte=min_lon)
+    else:
+        # Crosses the antimeridian: [min_lon, 180] and [-180, max_lon]
+        longitudes = Q(east__gte=min_lon) | Q(west__lte=max_lon)
+
+    height, _ = geohash.cell_size(resolution)
+    return DensityCell.objects.filter(
+        longitudes,
+        resolution=resolution,
+        state=state or "",
+        city=(city or "") if state else "",
+        # A cell intersecting the box starts at most one cell height below it. Both bounds on south keep the
+        # read of density_cell_bbox_idx to the box's latitudes, instead of every cell south of max_lat.
+        south__gte=min_lat - height,
+        south__lte=max_lat,
+        north__gte=min_lat,
+    )
@@ -0,0 +1,393 @@
+"""
+Differential correctness harness for the business search engines.
+
+Generates randomized businesses and query points (including near the poles, across the antimeridian and around
+the equator / prime meridian), runs every BusinessSearcher engine against them, and compares the results with a
+pure python brute-force oracle (search/geodesic.py). Run it with `python manage.py compare_searchers`.
+
+Generated businesses only ever go into throwaway databases (see throwaway_databases()), never into the live tables
+where concurrent searches could return them.
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import random
+import time
+
+from django.contrib.gis.geos import Point
+from django.db import DEFAULT_DB_ALIAS
+from django.test.utils import setup_databases, teardown_databases
+
+from search import centroids, sharding
+from search.admission import SearchBudget
+from search.constants import RADIUS_INCREMENTS_KM, US_STATES
+from search.geodesic import geodesic_distance_m, spherical_distance_m
+from search.models import Business, CityCentroid
+from search.search_helper import BusinessSearcher
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+# Generated businesses are tagged with this prefix so they can be told apart from (and cleaned up after) real data
+GENERATED_NAME_PREFIX = "__differential__ "
+
+# City names shared by several states, to catch city/state lookups leaking out of the requested state
+GENERATED_CITIES = ["Springfield", "Franklin", "Greenville", "Clinton", "Fairview", "Salem", "Madison", "Georgetown"]
+
+# GeoDjango distance lookups on SpatiaLite measure on the sphere unless asked for the spheroid, which is up to
+# ~0.56% off the ellipsoidal geodesic (north-south near the equator: 110.574 vs 111.195 km per degree).
+# Businesses the sphere and the ellipsoid put on opposite sides of the search radius, or that are this close to it,
+# are reported as boundary cases rather than mismatches.
+DEFAULT_RELATIVE_TOLERANCE = 0.006
+
+# (database alias, primary key). Ids are only unique per database once the store is sharded.
+BusinessKey = Tuple[str, int]
+
+
+@dataclass
+class QueryCase:
+    kind: str  # "radius" or "city_state"
+    label: str
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    radius_km: Optional[float] = None
+    city: Optional[str] = None
+    state: Optional[str] = None
+
+    def __str__(self) -> str:
+        if self.kind == "radius":
+            return f"{self.label}: {self.radius_km} km around ({self.lat:.5f}, {self.lon:.5f})"
+        return f"{self.label}: {self.city}, {self.state}"
+
+
+@dataclass
+class Mismatch:
+    case: QueryCase
+    engine: str
+    missing: List[BusinessKey]
+    extra: List[BusinessKey]
+
+
+@dataclass
+class DifferentialReport:
+    cases: List[QueryCase] = field(default_factory=list)
+    mismatches: List[Mismatch] = field(default_factory=list)
+    boundary_count: int = 0
+    # engine name -> seconds per query
+    timings: Dict[str, List[float]] = field(default_factory=dict)
+
+    def record_timing(self, engine: str, seconds: float) -> None:
+        self.timings.setdefault(engine, []).append(seconds)
+
+    def format(self, max_mismatches: int = 20) -> str:
+        mismatch_counts: Dict[str, int] = {}
+        for mismatch in self.mismatches:
+            mismatch_counts[mismatch.engine] = mismatch_counts.get(mismatch.engine, 0) + 1
+
+        lines = [
+            f"{len(self.cases)} queries, {len(self.mismatches)} mismatches, "
+            f"{self.boundary_count} businesses within tolerance of a search radius (not counted)",
+            "",
+            f"{'engine':<32}{'queries':>9}{'mismatches':>12}{'total ms':>11}{'mean ms':>10}{'max ms':>10}",
+        ]
+        for engine, seconds in self.timings.items():
+            lines.append(
+                f"{engine:<32}{len(seconds):>9}{mismatch_counts.get(engine, 0):>12}"
+                f"{sum(seconds) * 1000:>11.1f}{sum(seconds) * 1000 / len(seconds):>10.2f}{max(seconds) * 1000:>10.2f}"
+            )
+        for mismatch in self.mismatches[:max_mismatches]:
+            lines.append("")
+            lines.append(f"[{mismatch.engine}] {mismatch.case}")
+            if mismatch.missing:
+                lines.append(f"  missing: {mismatch.missing}")
+            if mismatch.extra:
+                lines.append(f"  extra:   {mismatch.extra}")
+        if len(self.mismatches) > max_mismatches:
+            lines.append(f"... and {len(self.mismatches) - max_mismatches} more mismatches")
+        return "\n".join(lines)
+
+
+# Engines under test. Each one takes the searcher and a query case and returns businesses,
+# or None when it can't answer that case (which isn't counted either way).
+RADIUS_ENGINES: Dict[str, Callable[[BusinessSearcher, QueryCase], Optional[List[Business]]]] = {
+    # What radius searches actually run: the shard fan-out, the centroid table or the ORM, whichever applies
+    "radius search (dispatch)": lambda searcher, case: searcher._find_businesses_within_radius(case.lat, case.lon, case.radius_km),
+    "orm (distance_lte)": lambda searcher, case: [
+        business for alias in sharding.business_aliases()
+        for business in searcher._find_businesses_within_radius_orm(case.lat, case.lon, case.radius_km, using=alias)
+    ],
+    "centroid table": lambda searcher, case: centroids.businesses_within_radius_of_centroid(case.lat, case.lon, case.radius_km),
+    "raw sql (ST_Distance)": lambda searcher, case: searcher._find_businesses_within_radius_sql(case.lat, case.lon, case.radius_km),
+    # A single expansion keeps the walk to the query radius, so the answer is exactly the businesses within it
+    "combined (radius only)": lambda searcher, case: searcher.find_businesses_combined(
+        case.lat, case.lon, case.radius_km, None, None, SearchBudget(max_expansions=1)
+    )[1],
+}
+CITY_STATE_ENGINES: Dict[str, Callable[[BusinessSearcher, QueryCase], Optional[List[Business]]]] = {
+    "get_businesses_by_city_state": lambda searcher, case: searcher.get_businesses_by_city_state(case.city, case.state),
+    "find_businesses_by_location": lambda searcher, case: searcher.find_businesses_by_location(case.city, case.state),
+    "combined (city/state only)": lambda searcher, case: searcher.find_businesses_combined(
+        None, None, 0, case.city, case.state, SearchBudget()
+    )[1],
+}
+
+
+def _random_location(rng: random.Random) -> Tuple[float, float]:
+    """
+    Random (lat, lon), mostly over the US with a share of awkward spots mixed in.
+    """
+    roll = rng.random()
+    if roll < 0.6:
+        return rng.uniform(25.0, 49.0), rng.uniform(-125.0, -67.0)
+    if roll < 0.7:
+        return rng.uniform(89.0, 90.0), rng.uniform(-180.0, 180.0)
+    if roll < 0.75:
+        return rng.uniform(-90.0, -89.0), rng.uniform(-180.0, 180.0)
+    if roll < 0.9:
+        return rng.uniform(-60.0, 70.0), rng.choice([-1, 1]) * rng.uniform(179.0, 180.0)
+    return rng.uniform(-1.0, 1.0), rng.uniform(-1.0, 1.0)
+
+
+def generate_dataset(rng: random.Random, size: int) -> List[Business]:
+    """
+    Build (unsaved) randomized businesses.
+
+    Args:
+        rng: Random number generator, seeded by the caller for reproducible runs
+        size: Number of businesses to generate
+
+    Returns:
+        List[Business]: Unsaved Business objects named with GENERATED_NAME_PREFIX
+    """
+    businesses = []
+    for i in range(size):
+        lat, lon = _random_location(rng)
+        businesses.append(Business(
+            name=f"{GENERATED_NAME_PREFIX}{i}",
+            city=rng.choice(GENERATED_CITIES),
+            state=rng.choice(US_STATES)[0],
+            location=Point(lon, lat, srid=4326),
+        ))
+    return businesses
+
+
+def generate_query_cases(rng: random.Random, dataset: List[Business], count: int) -> List[QueryCase]:
+    """
+    Build randomized query cases: radius searches around (jittered) dataset points plus a fixed set of
+    edge-case centers, and city/state searches both for pairs that exist and for pairs that don't.
+
+    Args:
+        rng: Random number generator, seeded by the caller for reproducible runs
+        dataset: Businesses to draw query points and city/state pairs from
+        count: Number of random radius queries (and half as many city/state queries) to generate
+
+    Returns:
+        List[QueryCase]: The query cases
+    """
+    cases = []
+    edge_centers = [
+        ("north pole", 90.0, 0.0),
+        ("near north pole", 89.95, 135.0),
+        ("near south pole", -89.9, -45.0),
+        ("antimeridian east", 10.0, 180.0),
+        ("antimeridian west", 10.0, -179.99),
+        ("null island", 0.0, 0.0),
+    ]
+    for label, lat, lon in edge_centers:
+        for radius_km in (RADIUS_INCREMENTS_KM[0], RADIUS_INCREMENTS_KM[-1]):
+            cases.append(QueryCase(kind="radius", label=label, lat=lat, lon=lon, radius_km=radius_km))
+
+    for _ in range(count if dataset else 0):
+        anchor = rng.choice(dataset).location
+        radius_km = rng.choice(RADIUS_INCREMENTS_KM)
+        # Jitter the center by up to about one radius so some businesses land right around the edge
+        jitter = radius_km / 111.32
+        lat = max(-90.0, min(90.0, anchor.y + rng.uniform(-jitter, jitter)))
+        lon = (anchor.x + rng.uniform(-jitter, jitter) + 180.0) % 360.0 - 180.0
+        cases.append(QueryCase(kind="radius", label="random", lat=lat, lon=lon, radius_km=radius_km))
+
+    for _ in range(count // 2 if dataset else 0):
+        business = rng.choice(dataset)
+        cases.append(QueryCase(kind="city_state", label="existing", city=business.city, state=business.state))
+        # Same city name, random state. Often a pair that doesn't exist in the dataset.
+        cases.append(QueryCase(kind="city_state", label="random state", city=business.city, state=rng.choice(US_STATES)[0]))
+    return cases
+
+
+def centroid_query_cases(rng: random.Random, count: int) -> List[QueryCase]:
+    """
+    Radius searches centered exactly on materialized city centroids, the only ones the centroid table answers.
+
+    Args:
+        rng: Random number generator, seeded by the caller for reproducible runs
+        count: Max number of centroids to search around
+
+    Returns:
+        List[QueryCase]: The query cases, one radius each
+    """
+    if not centroids.is_enabled():
+        return []
+    cases = []
+    for centroid in CityCentroid.objects.order_by("state", "city")[:count]:
+        cases.append(QueryCase(
+            kind="radius", label=f"centroid of {centroid}", lat=centroid.location.y, lon=centroid.location.x,
+            radius_km=rng.choice(RADIUS_INCREMENTS_KM),
+        ))
+    return cases
+
+
+def load_reference_rows() -> List[Tuple[BusinessKey, float, float, str, str]]:
+    """
+    Read every business (generated and pre-existing) from every database holding businesses.
+
+    Returns:
+        List[Tuple[BusinessKey, float, float, str, str]]: (key, lat, lon, city, state) per business
+    """
+    rows = []
+    for alias in sharding.business_aliases():
+        for pk, location, city, state in Business.objects.using(alias).values_list("pk", "location", "city", "state"):
+            rows.append(((alias, pk), location.y, location.x, city, state))
+    return rows
+
+
+def oracle_radius(rows, case: QueryCase, relative_tolerance: float) -> Tuple[Set[BusinessKey], Set[BusinessKey]]:
+    """
+    Brute-force the expected answer of a radius query.
+
+    Returns:
+        Tuple[Set[BusinessKey], Set[BusinessKey]]: Businesses clearly inside the radius,
+            and businesses too close to the radius to call either way
+    """
+    radius_m = case.radius_km * 1000
+    slack_m = radius_m * relative_tolerance + 1.0
+    inside, boundary = set(), set()
+    for key, lat, lon, _, _ in rows:
+        distance_m = geodesic_distance_m(case.lat, case.lon, lat, lon)
+        spherical_inside = spherical_distance_m(case.lat, case.lon, lat, lon) <= radius_m
+        if abs(distance_m - radius_m) <= slack_m or spherical_inside != (distance_m <= radius_m):
+            boundary.add(key)
+        elif distance_m < radius_m:
+            inside.add(key)
+    return inside, boundary
+
+
+def oracle_city_state(rows, case: QueryCase) -> Set[BusinessKey]:
+    """
+    Brute-force the expected answer of a city/state query. Exact match, like the data is stored.
+    """
+    return {key for key, _, _, city, state in rows if city == case.city and state == case.state}
+
+
+def _keys(businesses: List[Business]) -> Set[BusinessKey]:
+    return {(business._state.db, business.pk) for business in businesses}
+
+
+def compare(searcher: BusinessSearcher, cases: List[QueryCase], relative_tolerance: float = DEFAULT_RELATIVE_TOLERANCE) -> DifferentialReport:
+    """
+    Run every engine over the query cases and compare each against the oracle.
+
+    Args:
+        searcher: The searcher under test
+        cases: Query cases to run
+        relative_tolerance: Fraction of the radius around it where disagreement isn't counted as a mismatch
+
+    Returns:
+        DifferentialReport: Mismatches and per-engine timings
+    """
+    report = DifferentialReport(cases=list(cases))
+    rows = load_reference_rows()
+
+    for case in cases:
+        start = time.perf_counter()
+        if case.kind == "radius":
+            expected, boundary = oracle_radius(rows, case, relative_tolerance)
+            engines = RADIUS_ENGINES
+        else:
+            expected, boundary = oracle_city_state(rows, case), set()
+            engines = CITY_STATE_ENGINES
+        report.record_timing(f"oracle ({case.kind})", time.perf_counter() - start)
+        report.boundary_count += len(boundary)
+
+        for engine, run in engines.items():
+            start = time.perf_counter()
+            businesses = run(searcher, case)
+            if businesses is None:
+                continue
+            actual = _keys(businesses)
+            report.record_timing(engine, time.perf_counter() - start)
+
+            missing = sorted(expected - actual)
+            extra = sorted(actual - expected - boundary)
+            if missing or extra:
+                report.mismatches.append(Mismatch(case=case, engine=engine, missing=missing, extra=extra))
+    return report
+
+
+@contextmanager
+def throwaway_databases(verbosity: int = 0) -> Iterator[None]:
+    """
+    Point the default and business databases at freshly created and migrated test databases while the block runs,
+    and destroy them afterwards.
+
+    Args:
+        verbosity: Verbosity of the database creation output
+    """
+    aliases = {DEFAULT_DB_ALIAS, *sharding.business_aliases()}
+    old_config = setup_databases(verbosity, interactive=False, aliases=aliases, serialized_aliases=set())
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity)
+
+
+def run_differential(
+        size: int = 500,
+        queries: int = 50,
+        seed: int = 0,
+        relative_tolerance: float = DEFAULT_RELATIVE_TOLERANCE,
+        generate: bool = True,
+        searcher: Optional[BusinessSearcher] = None,
+) -> DifferentialReport:
+    """
+    Generate a randomized dataset, run the comparison and clean up after itself.
+
+    Generated rows are committed (the sharded radius search reads them from worker threads with their own
+    connections), so only generate into test databases: a test's, or throwaway_databases(). They're deleted again
+    afterwards, and any other businesses in the database take part in the comparison.
+
+    Args:
+        size: Number of businesses to generate
+        queries: Number of random radius queries to generate
+        seed: Random seed, so a failing run can be reproduced
+        relative_tolerance: Fraction of the radius around it where disagreement isn't counted as a mismatch
+        generate: Set to False to only compare against the data already in the database (read only)
+        searcher: The searcher under test. Defaults to a BusinessSearcher with default settings.
+
+    Returns:
+        DifferentialReport: Mismatches and per-engine timings
+    """
+    rng = random.Random(seed)
+    searcher = searcher or BusinessSearcher()
+
+    if generate:
+        dataset = generate_dataset(rng, size)
+    else:
+        dataset = [
+            business for alias in sharding.business_aliases()
+            for business in Business.objects.using(alias).only("location", "city", "state")
+        ]
+
+    try:
+        if generate:
+            by_alias: Dict[str, List[Business]] = {}
+            for business in dataset:
+                by_alias.setdefault(sharding.shard_for_state(business.state), []).append(business)
+            for alias, businesses in by_alias.items():
+                Business.objects.using(alias).bulk_create(businesses, batch_size=500)
+            # The centroid table has to match the data for the searches answered from it
+            centroids.refresh_city_centroids()
+
+        cases = generate_query_cases(rng, dataset, queries) + centroid_query_cases(rng, queries // 2)
+        return compare(searcher, cases, relative_tolerance)
+    finally:
+        if generate:
+            for alias in sharding.business_aliases():
+                Business.objects.using(alias).filter(name__startswith=GENERATED_NAME_PREFIX).delete()
+            centroids.refresh_city_centroids()
@@ -0,0 +1,243 @@
+import math
+
+from typing import List, Sequence, Tuple
+
+# WGS84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
+# Mean earth radius (IUGG), used by the spherical fallback
+MEAN_EARTH_RADIUS_M = 6371008.8
+
+# Rough size of one degree of latitude. Good enough for building a bounding box around a search circle.
+KM_PER_DEGREE = 111.32
+
+# A degree is a little shorter than KM_PER_DEGREE on the sphere (and near the equator on the ellipsoid),
+# so bounding boxes get padded to never cut off the edge of a search circle.
+BBOX_PADDING = 1.01
+
+# (min_lon, min_lat, max_lon, max_lat)
+BBox = Tuple[float, float, float, float]
+
+
+def spherical_distance_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Great-circle (haversine) distance between two WGS84 points on a sphere of mean earth radius.
+
+    Args:
+        lat1: First point latitude
+        lon1: First point longitude
+        lat2: Second point latitude
+        lon2: Second point longitude
+
+    Returns:
+        float: Distance in meters
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    h = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * MEAN_EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(h)))
+
+
+def geodesic_distance_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Distance between two WGS84 points on the ellipsoid, using Vincenty's inverse formula.
+    Pure python and slow, meant as a reference to check the database against, not for serving requests.
+
+    Vincenty doesn't converge for nearly antipodal points. Those fall back to the spherical distance,
+    which is far beyond any search radius we care about anyway.
+
+    Args:
+        lat1: First point latitude
+        lon1: First point longitude
+        lat2: Second point latitude
+        lon2: Second point longitude
+
+    Returns:
+        float: Distance in meters
+    """
+    if lat1 == lat2 and lon1 == lon2:
+        return 0.0
+
+    # Wrap the longitude difference into [-pi, pi] so points either side of the antimeridian are close
+    L = math.radians((lon2 - lon1 + 180.0) % 360.0 - 180.0)
+    U1 = math.atan((1 - WGS84_F) * math.tan(math.radians(lat1)))
+    U2 = math.atan((1 - WGS84_F) * math.tan(math.radians(lat2)))
+    sin_u1, cos_u1 = math.sin(U1), math.cos(U1)
+    sin_u2, cos_u2 = math.sin(U2), math.cos(U2)
+
+    lam = L
+    for _ in range(200):
+        sin_lam, cos_lam = math.sin(lam), math.cos(lam)
+        sin_sigma = math.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+        if sin_sigma == 0:
+            # Coincident points
+            return 0.0
+        cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+        sigma = math.atan2(sin_sigma, cos_sigma)
+        sin_alpha = cos_u1 * cos_u2 * sin_lam / sin_sigma
+        cos2_alpha = 1 - sin_alpha ** 2
+        # cos2_alpha is 0 for points on the equator
+        cos_2sigma_m = cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha if cos2_alpha else 0.0
+        C = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+        lam_prev = lam
+        lam = L + (1 - C) * WGS84_F * sin_alpha * (
+            sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2))
+        )
+        if abs(lam - lam_prev) < 1e-12:
+            break
+    else:
+        return spherical_distance_m(lat1, lon1, lat2, lon2)
+
+    u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = B * sin_sigma * (
+        cos_2sigma_m + B / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+            - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)
+        )
+    )
+    return WGS84_B * A * (sigma - delta_sigma)
+
+
+def circle_bbox(lat: float, lon: float, radius_km: float) -> BBox:
+    """
+    Bounding box that fully contains a search circle.
+    Near the poles or across the antimeridian this falls back to the full longitude range,
+    which over-selects but never misses anything.
+
+    Args:
+        lat: Center point latitude (WGS84)
+        lon: Center point longitude (WGS84)
+        radius_km: Search radius in kilometers
+
+    Returns:
+        BBox: (min_lon, min_lat, max_lon, max_lat)
+    """
+    delta_lat = radius_km * BBOX_PADDING / KM_PER_DEGREE
+    min_lat = max(lat - delta_lat, -90.0)
+    max_lat = min(lat + delta_lat, 90.0)
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        return -180.0, min_lat, 180.0, max_lat
+
+    # The circle is widest (in degrees of longitude) at the latitude closest to a pole
+    widest_lat = max(abs(min_lat), abs(max_lat))
+    delta_lon = radius_km * BBOX_PADDING / (KM_PER_DEGREE * math.cos(math.radians(widest_lat)))
+    min_lon, max_lon = lon - delta_lon, lon + delta_lon
+    if min_lon < -180.0 or max_lon > 180.0:
+        return -180.0, min_lat, 180.0, max_lat
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def bboxes_intersect(a: BBox, b: BBox) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def bbox_union(boxes: Sequence[BBox]) -> BBox:
+    return (
+        min(box[0] for box in boxes),
+        min(box[1] for box in boxes),
+        max(box[2] for box in boxes),
+        max(box[3] for box in boxes),
+    )
+
+
+def polyline_bboxes(coords: Sequence[Tuple[float, float]], buffer_km: float, piece_km: float = 10.0) -> List[BBox]:
+    """
+    Bounding boxes that together contain a polyline buffered by a distance. Unlike a single box around the whole
+    polyline, they hug long or diagonal routes closely.
+
+    Segments are cut into pieces of about piece_km (or twice the buffer, whichever is longer), interpolated linearly
+    in lon/lat like locate_on_polyline() treats them, and each piece gets the box around its two buffered ends.
+
+    Args:
+        coords: (lon, lat) vertices, GeoJSON order
+        buffer_km: Buffer distance in kilometers
+        piece_km: Target length of a piece in kilometers
+
+    Returns:
+        List[BBox]: (min_lon, min_lat, max_lon, max_lat) per piece
+    """
+    if len(coords) == 1:
+        return [circle_bbox(coords[0][1], coords[0][0], buffer_km)]
+
+    piece_km = max(piece_km, 2 * buffer_km)
+    boxes = []
+    for (lon1, lat1), (lon2, lat2), length_m in zip(coords, coords[1:], polyline_lengths_m(coords)):
+        # Wrap the longitude difference so segments crossing the antimeridian go the short way round
+        d_lon = (lon2 - lon1 + 180.0) % 360.0 - 180.0
+        pieces = max(1, math.ceil(length_m / 1000 / piece_km))
+        ends = [
+            (lat1 + (lat2 - lat1) * i / pieces, (lon1 + d_lon * i / pieces + 180.0) % 360.0 - 180.0)
+            for i in range(pieces + 1)
+        ]
+        for (a_lat, a_lon), (b_lat, b_lon) in zip(ends, ends[1:]):
+            boxes.append(bbox_union([circle_bbox(a_lat, a_lon, buffer_km), circle_bbox(b_lat, b_lon, buffer_km)]))
+    return boxes
+
+
+def polyline_lengths_m(coords: Sequence[Tuple[float, float]]) -> List[float]:
+    """
+    Geodesic length of each segment of a polyline.
+
+    Args:
+        coords: (lon, lat) vertices, GeoJSON order
+
+    Returns:
+        List[float]: Segment lengths in meters, one fewer than there are vertices
+    """
+    return [
+        geodesic_distance_m(lat1, lon1, lat2, lon2)
+        for (lon1, lat1), (lon2, lat2) in zip(coords, coords[1:])
+    ]
+
+
+def locate_on_polyline(
+        lat: float,
+        lon: float,
+        coords: Sequence[Tuple[float, float]],
+        segment_lengths_m: Sequence[float] = None,
+) -> Tuple[float, float]:
+    """
+    Distance from a point to a polyline, and how far along the polyline its closest point is.
+
+    Each segment is projected onto a plane tangent at the point (equirectangular), which is accurate to
+    well under a percent for segments and offsets up to a few hundred km.
+
+    Args:
+        lat: Point latitude (WGS84)
+        lon: Point longitude (WGS84)
+        coords: (lon, lat) vertices of the polyline, GeoJSON order
+        segment_lengths_m: Precomputed polyline_lengths_m(coords), to avoid recomputing them for every point
+
+    Returns:
+        Tuple[float, float]: (distance to the polyline, distance along the polyline to the closest point), in meters
+    """
+    if segment_lengths_m is None:
+        segment_lengths_m = polyline_lengths_m(coords)
+
+    cos_lat = math.cos(math.radians(lat))
+    meters_per_degree = KM_PER_DEGREE * 1000
+
+    def project(vertex_lon: float, vertex_lat: float) -> Tuple[float, float]:
+        # Wrap the longitude difference so segments crossing the antimeridian stay short
+        d_lon = (vertex_lon - lon + 180.0) % 360.0 - 180.0
+        return d_lon * cos_lat * meters_per_degree, (vertex_lat - lat) * meters_per_degree
+
+    best_distance_m, best_along_m = math.inf, 0.0
+    walked_m = 0.0
+    for (lon1, lat1), (lon2, lat2), segment_length_m in zip(coords, coords[1:], segment_lengths_m):
+        ax, ay = project(lon1, lat1)
+        bx, by = project(lon2, lat2)
+        dx, dy = bx - ax, by - ay
+        length_sq = dx * dx + dy * dy
+        # The point sits at the origin, so the closest spot on the segment is at -a projected onto (b - a)
+        t = 0.0 if length_sq == 0 else max(0.0, min(1.0, -(ax * dx + ay * dy) / length_sq))
+        distance_m = math.hypot(ax + t * dx, ay + t * dy)
+        if distance_m < best_distance_m:
+            best_distance_m, best_along_m = distance_m, walked_m + t * segment_length_m
+        walked_m += segment_length_m
+    return best_distance_m, best_along_m
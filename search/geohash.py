@@ -0,0 +1,79 @@
+"""
+Minimal geohash encoding, used to key the precomputed density cells (see search/density.py).
+"""
+from typing import Tuple
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def encode(lat: float, lon: float, precision: int) -> str:
+    """
+    Geohash of a point.
+
+    Args:
+        lat: Latitude (WGS84)
+        lon: Longitude (WGS84)
+        precision: Number of characters, i.e. the resolution of the cell
+
+    Returns:
+        str: The geohash of the cell containing the point
+    """
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits, bit_count, even = 0, 0, True
+    while len(chars) < precision:
+        # Bits alternate between longitude and latitude, starting with longitude
+        value, value_range = (lon, lon_range) if even else (lat, lat_range)
+        mid = (value_range[0] + value_range[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            value_range[0] = mid
+        else:
+            bits <<= 1
+            value_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def bounds(cell: str) -> Tuple[float, float, float, float]:
+    """
+    Bounding box of a geohash cell.
+
+    Args:
+        cell: Geohash
+
+    Returns:
+        Tuple[float, float, float, float]: (south, west, north, east)
+    """
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in cell:
+        bits = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            value_range = lon_range if even else lat_range
+            mid = (value_range[0] + value_range[1]) / 2
+            if (bits >> shift) & 1:
+                value_range[0] = mid
+            else:
+                value_range[1] = mid
+            even = not even
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+
+def cell_size(precision: int) -> Tuple[float, float]:
+    """
+    Size of the geohash cells at a precision. Every cell of a precision has the same size in degrees.
+
+    Args:
+        precision: Number of characters
+
+    Returns:
+        Tuple[float, float]: (height, width) in degrees
+    """
+    # 5 bits per character, alternating between longitude and latitude starting with longitude
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
@@ -2,6 +2,8 @@ from django.db import connection
 from django.http import JsonResponse
 from django.views import View
 
+from search.search_helper import search_admission, search_flight
+
 class HealthCheckView(View):
     """
     Health check endpoint that verifies the application is running and database is accessible.
@@ -19,7 +21,10 @@ class HealthCheckView(View):
         status_code = 200 if db_status else 503
         response_data = {
             'status': 'healthy' if status_code == 200 else 'unhealthy',
-            'database': 'connected' if db_status else 'disconnected'
+            'database': 'connected' if db_status else 'disconnected',
+            # How many identical concurrent searches shared an execution instead of running their own
+            'search_coalescing': search_flight.stats(),
+            'search_admission': search_admission.stats(),
         }
 
         return JsonResponse(
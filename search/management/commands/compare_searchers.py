@@ -0,0 +1,62 @@
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from search.differential import DEFAULT_RELATIVE_TOLERANCE, run_differential, throwaway_databases
+
+
+class Command(BaseCommand):
+    help = 'Compare every business search engine against a brute-force geodesic oracle on randomized data'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=500,
+            help='Number of random businesses to generate (default: 500)'
+        )
+        parser.add_argument(
+            '--queries',
+            type=int,
+            default=50,
+            help='Number of random radius queries to run (default: 50)'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Random seed, to reproduce a failing run (default: 0)'
+        )
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=DEFAULT_RELATIVE_TOLERANCE,
+            help=f'Fraction of the search radius around it where disagreements are not counted (default: {DEFAULT_RELATIVE_TOLERANCE})'
+        )
+        parser.add_argument(
+            '--no-generate',
+            action='store_true',
+            help='Compare against the businesses already in the database (read only) instead of generated ones'
+        )
+
+    def handle(self, *args, **options):
+        generate = not options['no_generate']
+        if generate:
+            # Generated businesses go into throwaway databases, never next to the live ones
+            self.stdout.write('Creating throwaway databases...')
+            databases = throwaway_databases(verbosity=options['verbosity'])
+        else:
+            databases = nullcontext()
+        with databases:
+            report = run_differential(
+                size=options['size'],
+                queries=options['queries'],
+                seed=options['seed'],
+                relative_tolerance=options['tolerance'],
+                generate=generate,
+            )
+        self.stdout.write(report.format())
+
+        if report.mismatches:
+            raise CommandError(f'{len(report.mismatches)} mismatches against the oracle (seed {options["seed"]})')
+        self.stdout.write(self.style.SUCCESS('All engines agree with the oracle'))
@@ -4,6 +4,7 @@ from django.contrib.gis.geos import Point
 from django.core.management.base import BaseCommand
 from django.conf import settings
 from search.models import Business
+from search import centroids, density, reload, sharding
 
 class Command(BaseCommand):
     help = 'Load business data from businesses.json file into the database'
@@ -20,6 +21,12 @@ class Command(BaseCommand):
             action='store_true',
             help='Clear existing business data before loading'
         )
+        parser.add_argument(
+            '--swap',
+            action='store_true',
+            help='Replace all existing business data without downtime: load into a shadow table, '
+                 'check it, then swap it in atomically (see search/reload.py)'
+        )
 
     def handle(self, *args, **options):
         file_path = options['file']
@@ -33,8 +40,15 @@ class Command(BaseCommand):
             self.stderr.write(self.style.ERROR(f'File not found: {file_path}'))
             return
         
+        if options['swap']:
+            self._swap(file_path)
+            return
+
         if clear_existing:
-            deleted_count, _ = Business.objects.all().delete()
+            deleted_count = 0
+            for alias in sharding.business_aliases():
+                alias_deleted_count, _ = Business.objects.using(alias).all().delete()
+                deleted_count += alias_deleted_count
             self.stdout.write(
                 self.style.WARNING(f'Deleted {deleted_count} existing businesses')
             )
@@ -45,10 +59,22 @@ class Command(BaseCommand):
 
             created_count = 0
             skipped_count = 0
+            # Tracked so the materialized city centroid tables can be refreshed incrementally
+            changed_cities = set()
+            changed_locations = []
+            added_points = []
 
             for biz_data in businesses_data:
+                # Businesses go to the shard holding their state (the default database when not sharded)
+                try:
+                    using = sharding.shard_for_state(biz_data['state'])
+                except ValueError:
+                    self.stderr.write(self.style.WARNING(f"No shard for state {biz_data['state']!r}, skipping {biz_data['name']}"))
+                    skipped_count += 1
+                    continue
+
                 # Skip if business with same name, city and state
-                if Business.objects.filter(
+                if Business.objects.using(using).filter(
                         name=biz_data['name'],
                         city=biz_data['city'],
                         state=biz_data['state']
@@ -64,13 +90,16 @@ class Command(BaseCommand):
                 )
 
                 # Create and save business
-                Business.objects.create(
+                Business.objects.using(using).create(
                     name=biz_data['name'],
                     city=biz_data['city'],
                     state=biz_data['state'],
                     location=location
                 )
                 created_count += 1
+                changed_cities.add((biz_data['city'], biz_data['state']))
+                changed_locations.append((location.y, location.x))
+                added_points.append((location.y, location.x, biz_data['city'], biz_data['state']))
 
             self.stdout.write(
                 self.style.SUCCESS(
@@ -78,6 +107,65 @@ class Command(BaseCommand):
                     f'Skipped {skipped_count} duplicates.'
                 )
             )
+
+            if clear_existing or changed_cities:
+                refreshed_count = centroids.refresh_city_centroids(
+                    None if clear_existing else changed_cities,
+                    changed_locations,
+                )
+                self.stdout.write(f'Refreshed nearest businesses for {refreshed_count} city centroids.')
+
+            if clear_existing or added_points:
+                cell_count = density.refresh_density_cells(None if clear_existing else added_points)
+                self.stdout.write(f'Refreshed {cell_count} density cells.')
+            
+        except json.JSONDecodeError:
+            self.stderr.write(self.style.ERROR('Error: Invalid JSON file'))
+        except KeyError as e:
+            self.stderr.write(self.style.ERROR(f'Missing required field: {e}'))
+        except Exception as e:
+            self.stderr.write(self.style.ERROR(f'An error occurred: {str(e)}'))
+
+    def _swap(self, file_path):
+        """
+        Load the file into shadow tables and swap them in for the live business table(s).
+        """
+        try:
+            with open(file_path, 'r') as f:
+                businesses_data = json.load(f)
+
+            rows = []
+            seen = set()
+            skipped_count = 0
+            for biz_data in businesses_data:
+                try:
+                    sharding.shard_for_state(biz_data['state'])
+                except ValueError:
+                    self.stderr.write(self.style.WARNING(f"No shard for state {biz_data['state']!r}, skipping {biz_data['name']}"))
+                    skipped_count += 1
+                    continue
+
+                # Skip if business with same name, city and state
+                key = (biz_data['name'], biz_data['city'], biz_data['state'])
+                if key in seen:
+                    skipped_count += 1
+                    continue
+                seen.add(key)
+
+                location = Point(
+                    float(biz_data['longitude']),
+                    float(biz_data['latitude']),
+                    srid=4326  # WGS84
+                )
+                rows.append((biz_data['name'], biz_data['city'], biz_data['state'], location))
+
+            loaded_counts = reload.reload_businesses(rows)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Successfully swapped in {sum(loaded_counts.values())} businesses. '
+                    f'Skipped {skipped_count} duplicates.'
+                )
+            )
             
         except json.JSONDecodeError:
             self.stderr.write(self.style.ERROR('Error: Invalid JSON file'))
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-19 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0003_citycentroid_citynearestbusiness'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DensityCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.PositiveSmallIntegerField()),
+                ('cell', models.CharField(max_length=12)),
+                ('state', models.CharField(blank=True, default='', max_length=2)),
+                ('city', models.CharField(blank=True, default='', max_length=128)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('south', models.FloatField()),
+                ('west', models.FloatField()),
+                ('north', models.FloatField()),
+                ('east', models.FloatField()),
+            ],
+            options={
+                'ordering': ['resolution', 'cell'],
+                'indexes': [models.Index(fields=['resolution', 'state', 'city', 'south'], name='density_cell_bbox_idx')],
+                'constraints': [models.UniqueConstraint(fields=('resolution', 'state', 'city', 'cell'), name='unique_density_cell')],
+            },
+        ),
+    ]
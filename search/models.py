@@ -9,6 +9,84 @@ class Business(models.Model):
 
     class Meta:
         ordering = ["name"]
+        indexes = [
+            # Default ordering, and prefix searches on name (the admin's search box)
+            models.Index(fields=["name"], name="business_name_idx"),
+            # City/state lookups, and the admin's state/city filters
+            models.Index(fields=["state", "city"], name="business_state_city_idx"),
+        ]
 
     def __str__(self) -> str:
         return f"{self.name} ({self.city}, {self.state})"
+
+
+class CityCentroid(models.Model):
+    """
+    Centroid of the businesses in a city, maintained by the loader (see search/centroids.py).
+    """
+    city = models.CharField(max_length=128)
+    state = models.CharField(max_length=2, choices=US_STATES)
+    location = models.PointField()
+    business_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ["state", "city"]
+        constraints = [
+            models.UniqueConstraint(fields=["city", "state"], name="unique_city_centroid"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.city}, {self.state}"
+
+
+class CityNearestBusiness(models.Model):
+    """
+    The k businesses nearest to a city centroid, precomputed so "near the center of <city>" is a single indexed read.
+    """
+    centroid = models.ForeignKey(CityCentroid, on_delete=models.CASCADE, related_name="nearest")
+    # No database constraint: the business table gets rebuilt wholesale by the loader and
+    # this table is refreshed right after, so it never needs to block or cascade a business delete.
+    business = models.ForeignKey(Business, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+")
+    rank = models.PositiveSmallIntegerField()
+    distance_meters = models.FloatField()
+
+    class Meta:
+        ordering = ["centroid", "rank"]
+        constraints = [
+            models.UniqueConstraint(fields=["centroid", "rank"], name="unique_city_nearest_rank"),
+        ]
+
+    def __str__(self) -> str:
+        return f"#{self.rank} near {self.centroid}: {self.business_id}"
+
+
+class DensityCell(models.Model):
+    """
+    Number of businesses in a geohash cell at one resolution, maintained by the loader (see search/density.py).
+
+    Rows with an empty state and city hold the total. Rows with only a state, or a state and a city,
+    hold the count broken down by state or by city.
+    """
+    resolution = models.PositiveSmallIntegerField()
+    cell = models.CharField(max_length=12)
+    state = models.CharField(max_length=2, blank=True, default="")
+    city = models.CharField(max_length=128, blank=True, default="")
+    count = models.PositiveIntegerField(default=0)
+    # Cell bounds, so the cells intersecting a bounding box are an indexed range read
+    south = models.FloatField()
+    west = models.FloatField()
+    north = models.FloatField()
+    east = models.FloatField()
+
+    class Meta:
+        ordering = ["resolution", "cell"]
+        constraints = [
+            models.UniqueConstraint(fields=["resolution", "state", "city", "cell"], name="unique_density_cell"),
+        ]
+        indexes = [
+            models.Index(fields=["resolution", "state", "city", "south"], name="density_cell_bbox_idx"),
+        ]
+
+    def __str__(self) -> str:
+        breakdown = ", ".join(part for part in (self.city, self.state) if part) or "all"
+        return f"{self.cell} ({breakdown}): {self.count}"
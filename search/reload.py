@@ -0,0 +1,229 @@
+"""
+Zero-downtime reload of the whole business dataset.
+
+`load_businesses --clear` deletes and re-inserts in place, so searches see an empty or half loaded table (and stall on
+SQLite's write lock) for the whole load. Instead, the new dataset is loaded into a shadow table next to the live one,
+with the same columns and indexes (spatial index included), and its row counts are checked. Then one short
+transaction renames the live table out of the way and renames the shadow table in its place, and a second one drops
+the old table. Readers see either the old dataset or the new one, and the swap holds the write lock for milliseconds.
+The databases run in WAL mode (see settings.SQLITE_INIT_COMMAND), so the long writes around it (loading the shadow
+table, rebuilding the centroid and density tables) don't lock readers out either.
+
+SQLite can't rename an index, so the swapped in table keeps the index names derived from its shadow table.
+Migrations refer to indexes by name, so restore_index_names() recreates them under their migration names
+right before migrating (see search/apps.py), instead of rebuilding them on the live table after every swap.
+"""
+from collections import defaultdict
+import uuid
+
+from django.apps.registry import Apps
+from django.contrib.gis.db import models
+from django.contrib.gis.geos import Point
+from django.db import connections, transaction
+
+from search import centroids, density, sharding
+from search.models import Business
+from search.spatial_index import index_table
+from typing import Dict, Iterable, List, Tuple, Type
+
+# (name, city, state, location) of a business to load
+BusinessRow = Tuple[str, str, str, Point]
+
+# Shadow tables are named <business table>_reload_<random suffix>. Index names are unique per database and Django
+# derives them from the table name, so a fresh name per reload keeps the shadow's indexes from clashing with the
+# live table's (which carry the previous shadow's names). Retired tables share the prefix, so one left behind by a
+# swap that died before dropping it gets cleaned up like any leftover shadow.
+SHADOW_TABLE_INFIX = "_reload_"
+
+
+def _shadow_model(db_table: str) -> Type[models.Model]:
+    """
+    An unmanaged-by-migrations copy of Business stored in db_table. It's registered in its own app registry,
+    so it never shows up in the project's models or migrations.
+    """
+    attrs = {
+        "__module__": Business.__module__,
+        "Meta": type("Meta", (), {
+            "app_label": Business._meta.app_label,
+            "db_table": db_table,
+            "apps": Apps(),
+            # Named indexes get a name derived from the shadow table instead, see restore_index_names()
+            "indexes": [_renamed(index, "") for index in Business._meta.indexes],
+        }),
+    }
+    for field in Business._meta.local_fields:
+        attrs[field.name] = field.clone()
+    return type(f"{Business.__name__}Shadow", (models.Model,), attrs)
+
+
+def _renamed(index: models.Index, name: str) -> models.Index:
+    index = index.clone()
+    index.name = name
+    return index
+
+
+def drop_leftover_shadows(alias: str) -> List[str]:
+    """
+    Drop shadow tables left behind by reloads that failed or got killed before swapping.
+
+    Args:
+        alias: Database alias to clean up
+
+    Returns:
+        List[str]: The dropped tables
+    """
+    prefix = f"{Business._meta.db_table}{SHADOW_TABLE_INFIX}"
+    connection = connections[alias]
+    leftovers = [table for table in connection.introspection.table_names() if table.startswith(prefix)]
+    for table in leftovers:
+        with connection.schema_editor(atomic=True) as editor:
+            editor.delete_model(_shadow_model(table))
+    return leftovers
+
+
+def build_shadow(alias: str, rows: List[BusinessRow]) -> Type[models.Model]:
+    """
+    Create a shadow business table, load the rows into it and check it holds all of them, index included.
+
+    Args:
+        alias: Database alias to build the shadow table in
+        rows: The businesses to load
+
+    Returns:
+        Type[models.Model]: Model of the loaded shadow table, to pass to swap_in()
+
+    Raises:
+        ValueError: If the loaded table doesn't hold exactly the given rows. The shadow table is dropped.
+    """
+    shadow = _shadow_model(f"{Business._meta.db_table}{SHADOW_TABLE_INFIX}{uuid.uuid4().hex[:8]}")
+    connection = connections[alias]
+    with connection.schema_editor(atomic=True) as editor:
+        editor.create_model(shadow)
+
+    try:
+        with transaction.atomic(using=alias):
+            shadow.objects.using(alias).bulk_create(
+                (shadow(name=name, city=city, state=state, location=location) for name, city, state, location in rows),
+                batch_size=2000,
+            )
+
+        row_count = shadow.objects.using(alias).count()
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {connection.ops.quote_name(index_table(shadow))}")
+            (indexed_count,) = cursor.fetchone()
+        if row_count != len(rows) or indexed_count != len(rows):
+            raise ValueError(
+                f"Shadow table {shadow._meta.db_table} on {alias} holds {row_count} rows ({indexed_count} in the "
+                f"spatial index), expected {len(rows)}"
+            )
+    except BaseException:
+        with connection.schema_editor(atomic=True) as editor:
+            editor.delete_model(shadow)
+        raise
+    return shadow
+
+
+def swap_in(alias: str, shadow: Type[models.Model]) -> None:
+    """
+    Replace the live business table with a loaded shadow table, in one short transaction, then drop the old table.
+
+    Args:
+        alias: Database alias holding both tables
+        shadow: Model returned by build_shadow()
+    """
+    live_table = Business._meta.db_table
+    retired = _shadow_model(f"{live_table}{SHADOW_TABLE_INFIX}retired_{uuid.uuid4().hex[:8]}")
+    connection = connections[alias]
+    with connection.schema_editor(atomic=True) as editor:
+        # RenameTable (SpatiaLite 5+) renames the table along with its geometry metadata, triggers and spatial index
+        editor.execute("SELECT RenameTable('main', %s, %s)", (live_table, retired._meta.db_table))
+        editor.execute("SELECT RenameTable('main', %s, %s)", (shadow._meta.db_table, live_table))
+        if centroids.is_enabled():
+            # The materialized rows point at ids of the old table. Without them searches take the live path
+            # until the centroids are rebuilt.
+            centroids.clear_city_centroids()
+
+    # Dropping the old table (and its spatial index) is the slow part, so it gets its own transaction
+    # instead of holding up the swap
+    with connection.schema_editor(atomic=True) as editor:
+        editor.delete_model(retired)
+
+
+def restore_index_names(alias: str, model: Type[models.Model] = Business) -> List[str]:
+    """
+    Recreate the business table's indexes that are missing under the name migrations know them by, from the index
+    on the same columns a swap left under its shadow derived name.
+
+    Args:
+        alias: Database alias holding the business table
+        model: Business as the migration state knows it
+
+    Returns:
+        List[str]: Names of the recreated indexes
+    """
+    connection = connections[alias]
+    table = model._meta.db_table
+    if table not in connection.introspection.table_names():
+        return []
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+
+    restored = []
+    for index in model._meta.indexes:
+        if index.name in constraints or not index.fields:
+            continue
+        columns = [model._meta.get_field(field_name).column for field_name, _ in index.fields_orders]
+        stale = [
+            name for name, constraint in constraints.items()
+            if constraint["index"] and not constraint["unique"] and constraint["columns"] == columns
+        ]
+        if not stale:
+            continue
+        with connection.schema_editor(atomic=True) as editor:
+            editor.add_index(model, index)
+            for name in stale:
+                editor.remove_index(model, _renamed(index, name))
+        restored.append(index.name)
+    return restored
+
+
+def reload_businesses(rows: Iterable[BusinessRow]) -> Dict[str, int]:
+    """
+    Replace every business with the given ones, without readers ever seeing a partially loaded dataset.
+
+    All shadow tables are built and checked before any is swapped in. With a sharded store each shard is swapped
+    in its own transaction, one right after the other.
+
+    Args:
+        rows: The businesses to load. They must map to a database (see sharding.shard_for_state).
+
+    Returns:
+        Dict[str, int]: Number of businesses loaded per database alias
+
+    Raises:
+        ValueError: If there's nothing to load, or a shadow table failed its check. Nothing gets swapped in.
+    """
+    rows_by_alias = defaultdict(list)
+    for row in rows:
+        rows_by_alias[sharding.shard_for_state(row[2])].append(row)
+    if not rows_by_alias:
+        raise ValueError("Refusing to replace the businesses with an empty dataset")
+
+    shadows = {}
+    try:
+        for alias in sharding.business_aliases():
+            drop_leftover_shadows(alias)
+            # Shards the new dataset has nothing for are swapped for an empty table
+            shadows[alias] = build_shadow(alias, rows_by_alias.get(alias, []))
+    except BaseException:
+        for alias, shadow in shadows.items():
+            with connections[alias].schema_editor(atomic=True) as editor:
+                editor.delete_model(shadow)
+        raise
+
+    for alias, shadow in shadows.items():
+        swap_in(alias, shadow)
+
+    centroids.refresh_city_centroids()
+    density.refresh_density_cells()
+    return {alias: len(rows_by_alias.get(alias, [])) for alias in shadows}
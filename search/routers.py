@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+class BusinessShardRouter:
+    """
+    Database router for the sharded business store (see BUSINESS_SHARDING in settings).
+
+    Business rows are routed by their state when the instance is known (e.g. Business.save()).
+    Queries that aren't tied to an instance should pick the shard explicitly with
+    `Business.objects.using(shard_for_state(state))`. Everything else stays on the default database.
+    """
+
+    @staticmethod
+    def _is_business(model) -> bool:
+        return model._meta.app_label == "search" and model._meta.model_name == "business"
+
+    def _db_for_instance(self, model, **hints):
+        instance = hints.get("instance")
+        if not self._is_business(model) or instance is None or not instance.state:
+            return None
+        # Imported here so the router can be loaded before the app registry is ready
+        from search.sharding import shard_for_state
+        return shard_for_state(instance.state)
+
+    def db_for_read(self, model, **hints):
+        return self._db_for_instance(model, **hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for_instance(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Objects on different shards can't reference each other
+        if obj1._state.db in settings.BUSINESS_SHARDS or obj2._state.db in settings.BUSINESS_SHARDS:
+            return obj1._state.db == obj2._state.db
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Shards only hold the business table. The default database keeps the full schema.
+        if db in settings.BUSINESS_SHARDS:
+            return app_label == "search" and model_name == "business"
+        if db == DEFAULT_DB_ALIAS:
+            return True
+        return None
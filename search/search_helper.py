@@ -1,14 +1,27 @@
+from django.conf import settings
+from django.contrib.gis.db.models import Collect
 from django.contrib.gis.db.models.functions import Distance
-from django.contrib.gis.geos import Point
+from django.contrib.gis.geos import GEOSException, GEOSGeometry, Point
 from django.contrib.gis.measure import D
-from django.db import connection
-from django.db.models import QuerySet
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, connections
+from django.db.models import F, FloatField, Func, QuerySet
 
 import bisect
-from search.models import Business
+import json
+import math
+import time
+from search.models import Business, CityCentroid
+from search import centroids, sharding
+from search.admission import AdmissionController, AdmittedSearcher, SearchBudget, query_deadline
+from search.geodesic import circle_bbox, locate_on_polyline, polyline_bboxes, polyline_lengths_m, spherical_distance_m
+from search.singleflight import CoalescingSearcher, SingleFlight
+from search.spatial_index import bbox_filter, bboxes_filter, index_lookup
 from .constants import RADIUS_INCREMENTS_KM
 from typing import List, Optional, Sequence, Union, Tuple
 
+# Spatial index lookups per route search query, kept well under SQLite's 500 part compound SELECT limit
+ROUTE_BBOXES_PER_QUERY = 100
+
 
 class BusinessSearcher:
     """
@@ -42,10 +55,72 @@ class BusinessSearcher:
         Returns:
             Tuple[int, List[Business]: List of found Business objects, or empty list if none found and the radius used
         """
+        radius_km, businesses, _ = self.find_businesses_incrementally_within_budget(
+            start_lat, start_lon, query_radius_km, SearchBudget()
+        )
+        return radius_km, businesses
+
+    def find_businesses_incrementally_within_budget(
+            self,
+            start_lat: float,
+            start_lon: float,
+            query_radius_km: int,
+            budget: SearchBudget,
+    ) -> Tuple[int, List[Business], Optional[str]]:
+        """
+        Same as find_businesses_incrementally, but stops once the work budget runs out.
+        A budget cut short returns what was found so far: nothing if it ran out of expansions or time,
+        the nearest budget.max_rows businesses if it ran out of rows.
+
+        Args:
+            start_lat: Starting latitude (WGS84)
+            start_lon: Starting longitude (WGS84)
+            query_radius_km: Query radius in kilometers
+            budget: Limits on expansions, rows and wall-clock time
+
+        Returns:
+            Tuple[int, List[Business], Optional[str]]: The radius used, the businesses found, and which limit
+                cut the search short ("expansions", "rows" or "deadline"), or None if it completed
+        """
         # If both lat and lon are not provided, return an empty list
         if not start_lat or not start_lon:
-            return 0, []
+            return 0, [], None
+        deadline = budget.deadline()
+        # Looked up once for the whole walk rather than at every radius
+        centroid = centroids.centroid_at(start_lat, start_lon)
+
+        for expansion, radius_km in enumerate(self._radii_km(query_radius_km)):
+            if budget.max_expansions is not None and expansion >= budget.max_expansions:
+                return 0, [], "expansions"
+            if deadline is not None and time.monotonic() >= deadline:
+                return 0, [], "deadline"
+            try:
+                businesses = self._find_businesses_within_radius(
+                    start_lat, start_lon, radius_km, max_rows=budget.max_rows, deadline=deadline, centroid=centroid
+                )
+            except OperationalError:
+                # SQLite interrupts the query once the deadline passes (see search/admission.py)
+                if deadline is not None and time.monotonic() >= deadline:
+                    return 0, [], "deadline"
+                raise
+            if businesses:
+                print(f"Found {len(businesses)} businesses within {radius_km} km.")
+                if budget.max_rows is not None and len(businesses) >= budget.max_rows:
+                    return radius_km, businesses, "rows"
+                return radius_km, businesses, None
+        # Found no businesses
+        return 0, [], None
+    
+    def _radii_km(self, query_radius_km: int) -> List[Union[int, float]]:
+        """
+        The radii, in order, that the incremental search tries.
+
+        Args:
+            query_radius_km: Query radius in kilometers
 
+        Returns:
+            List[Union[int, float]]: Radii in kilometers
+        """
         if query_radius_km and query_radius_km > 1:
             # Find the index of the first radius increment greater than the query radius to create a list of radii to search
             # insert_idx = bisect.bisect_right(self.radius_increments_km, query_radius_km)
@@ -55,18 +130,18 @@ class BusinessSearcher:
             radii_km = [query_radius_km]
             for increment in self.radius_increments_km:
                 radii_km.append(radii_km[0] + increment) # Could also do radii_km.append(radii_km[-1] + increment)
-        else:
-            radii_km = self.radius_increments_km
+            return radii_km
+        return list(self.radius_increments_km)
 
-        for radius_km in radii_km:
-            businesses = self._find_businesses_within_radius(start_lat, start_lon, radius_km)
-            if businesses:
-                print(f"Found {len(businesses)} businesses within {radius_km} km.")
-                return radius_km, businesses
-        # Found no businesses
-        return 0, []
-    
-    def _find_businesses_within_radius(self, lat: float, lon: float, radius_km: int) -> List[Business]:
+    def _find_businesses_within_radius(
+            self,
+            lat: float,
+            lon: float,
+            radius_km: int,
+            max_rows: Optional[int] = None,
+            deadline: Optional[float] = None,
+            centroid: Union[CityCentroid, None, object] = centroids.LOOK_UP,
+    ) -> List[Business]:
         """
         Find businesses within a specific radius of a point.
         Assumes radius is an int and is in kilometers and lat, lon are in WGS84.
@@ -75,11 +150,48 @@ class BusinessSearcher:
             lat: Center point latitude (WGS84)
             lon: Center point longitude (WGS84)
             radius_km: Search radius in kilometers
+            max_rows: Only return this many of the nearest businesses
+            deadline: time.monotonic() value after which the query gets interrupted
+            centroid: centroids.centroid_at(lat, lon), if already looked up
             
         Returns:
             List[Business]: List of businesses within the radius
         """
+        if sharding.is_sharded():
+            # Only the shards whose extents intersect the search circle get queried, in parallel.
+            return sharding.find_businesses_within_radius(lat, lon, radius_km, max_rows=max_rows, deadline=deadline)
+
+        # Searches centered on a known city centroid are a single read from the materialized nearest table
+        materialized = centroids.businesses_within_radius_of_centroid(lat, lon, radius_km, centroid=centroid)
+        if materialized is not None:
+            return materialized if max_rows is None else materialized[:max_rows]
 
+        return self._find_businesses_within_radius_orm(lat, lon, radius_km, max_rows=max_rows, deadline=deadline)
+
+    def _find_businesses_within_radius_orm(
+            self,
+            lat: float,
+            lon: float,
+            radius_km: int,
+            max_rows: Optional[int] = None,
+            deadline: Optional[float] = None,
+            using: str = DEFAULT_DB_ALIAS,
+    ) -> List[Business]:
+        """
+        Find businesses within a specific radius of a point with the GeoDjango ORM, on a single database.
+        Assumes radius is an int and is in kilometers and lat, lon are in WGS84.
+
+        Args:
+            lat: Center point latitude (WGS84)
+            lon: Center point longitude (WGS84)
+            radius_km: Search radius in kilometers
+            max_rows: Only return this many of the nearest businesses
+            deadline: time.monotonic() value after which the query gets interrupted
+            using: Database alias to search
+
+        Returns:
+            List[Business]: List of businesses within the radius, nearest first
+        """
         # Working with spatialite and django is painful!! BEWARE of taking this on short notice... chutzpah!
         # Fix that seems to work w/o errors: Use the django geodjango orm instead of raw sql. However, not sure if its
         # really returning all the businesses correctly. Need to build a test case to verify this.
@@ -116,7 +228,7 @@ class BusinessSearcher:
         # Also, dont really need the `distance_meters` field in the result set. Removing it will make this
         # query faster. However, for now keeping it since I am still working through things.
         point = Point(lon, lat, srid=4326)
-        businesses = Business.objects.filter(
+        businesses = Business.objects.using(using).filter(
             location__distance_lte=(
                 point,
                 D(km=radius_km)
@@ -124,8 +236,11 @@ class BusinessSearcher:
         ).annotate(
             distance_meters=Distance('location', point)
         ).order_by('distance_meters')
+        if max_rows is not None:
+            businesses = businesses[:max_rows]
 
-        return list(businesses)
+        with query_deadline(deadline, using=using):
+            return list(businesses)
 
         # Error: checking Geometry returned from GEOS C function "GEOSWKBReader_readHEX_r" : nightmare # 4
         # Even using AsBinary and GeomFromWKB so Django's ORM can handle the geometry returned from SpatiaLite
@@ -157,6 +272,301 @@ class BusinessSearcher:
         # # SpatiaLite uses X,Y (longitude,latitude) order for coordinates!!
         # return self._execute_sql_query(query, (lon, lat, radius_meters))
     
+    def _find_businesses_within_radius_sql(self, lat: float, lon: float, radius_km: int) -> List[Business]:
+        """
+        Find businesses within a specific radius of a point using raw spheroid ST_Distance SQL.
+        This is the "ids via raw sql, objects via the orm" approach from _find_businesses_within_radius.
+        Kept around so the differential harness (search/differential.py) can check it against the ORM path.
+
+        Args:
+            lat: Center point latitude (WGS84)
+            lon: Center point longitude (WGS84)
+            radius_km: Search radius in kilometers
+
+        Returns:
+            List[Business]: List of businesses within the radius, nearest first
+        """
+        # 1 = calculate in meters (spheroid)
+        query = """
+        SELECT id, distance_meters FROM (
+            SELECT
+                id,
+                ST_Distance(
+                    location,
+                    MakePoint(%s, %s, 4326),
+                    1
+                ) AS distance_meters
+            FROM
+                search_business
+        ) AS subquery
+        WHERE distance_meters <= %s
+        ORDER BY distance_meters;
+        """
+        radius_meters = radius_km * 1000
+        businesses = []
+        for alias in sharding.business_aliases():
+            with connections[alias].cursor() as cursor:
+                # SpatiaLite uses X,Y (longitude,latitude) order for coordinates!!
+                cursor.execute(query, (lon, lat, radius_meters))
+                distances = dict(cursor.fetchall())
+            for business_id, business in Business.objects.using(alias).in_bulk(list(distances)).items():
+                business.distance_meters = D(m=distances[business_id])
+                businesses.append(business)
+        businesses.sort(key=lambda business: business.distance_meters.m)
+        return businesses
+
+    def find_businesses_near_city_center(self, city: str, state: str) -> Tuple[Optional[Point], List[Business]]:
+        """
+        Find the businesses nearest to the center (centroid of its businesses) of a city.
+        Reads the materialized table maintained by the loader (search/centroids.py), and falls back to computing
+        the centroid and distance ordering on the fly when the city isn't materialized (or the store is sharded).
+
+        Args:
+            city: City name (exact match, like the data is stored)
+            state: State code (exact match, e.g., 'CA' for California)
+
+        Returns:
+            Tuple[Optional[Point], List[Business]]: The city center (None if the city has no businesses) and
+                up to CITY_NEAREST_K businesses nearest to it, nearest first
+        """
+        if not city or not state:
+            return None, []
+
+        centroid, businesses = centroids.nearest_to_city_center(city, state)
+        if centroid is not None:
+            return centroid.location, businesses
+
+        try:
+            city_businesses = Business.objects.using(sharding.shard_for_state(state)).filter(city=city, state=state)
+        except ValueError:
+            return None, []
+        points = city_businesses.aggregate(points=Collect('location'))['points']
+        if not points:
+            return None, []
+        center = points.centroid
+        center.srid = 4326
+
+        k = settings.CITY_NEAREST_K
+        businesses = []
+        for alias in sharding.business_aliases():
+            businesses.extend(
+                Business.objects.using(alias).annotate(
+                    distance_meters=Distance('location', center)
+                ).order_by('distance_meters')[:k]
+            )
+        businesses.sort(key=lambda business: business.distance_meters.m)
+        return center, businesses[:k]
+
+    @staticmethod
+    def _parse_geometry(geometry: Union[str, dict, GEOSGeometry], allowed_types: Sequence[str]) -> GEOSGeometry:
+        """
+        Turn GeoJSON (string or already decoded) into a WGS84 GEOS geometry of one of the allowed types.
+
+        Args:
+            geometry: GeoJSON string, decoded GeoJSON dict, or a GEOSGeometry
+            allowed_types: Accepted geometry types, e.g. ("Polygon", "MultiPolygon")
+
+        Returns:
+            GEOSGeometry: The parsed geometry
+
+        Raises:
+            ValueError: If the geometry can't be parsed, isn't one of the allowed types or isn't in WGS84
+        """
+        if isinstance(geometry, dict):
+            geometry = json.dumps(geometry)
+        if not isinstance(geometry, GEOSGeometry):
+            try:
+                geometry = GEOSGeometry(geometry)
+            except (GEOSException, ValueError, TypeError) as e:
+                raise ValueError(f"Invalid GeoJSON geometry: {e}")
+        if geometry.geom_type not in allowed_types:
+            raise ValueError(f"Expected a {' or '.join(allowed_types)} geometry, got {geometry.geom_type}")
+        if geometry.srid is None:
+            geometry.srid = 4326
+        elif geometry.srid != 4326:
+            # e.g. EWKT or EWKB carrying another SRID. The searches treat coordinates as lon/lat, so don't guess.
+            raise ValueError(f"Expected a WGS84 (SRID 4326) geometry, got SRID {geometry.srid}")
+        return geometry
+
+    def find_businesses_in_polygon(self, polygon: Union[str, dict, GEOSGeometry]) -> List[Business]:
+        """
+        Find businesses inside a polygon.
+        Candidates come from the spatial index (search/spatial_index.py) using the polygon's bounding box,
+        then get an exact within test.
+
+        Args:
+            polygon: GeoJSON Polygon or MultiPolygon in WGS84
+
+        Returns:
+            List[Business]: Businesses inside the polygon, nearest to its centroid first
+
+        Raises:
+            ValueError: If the polygon isn't valid GeoJSON or isn't a polygon
+        """
+        businesses, _ = self.find_businesses_in_polygon_within_budget(polygon, SearchBudget())
+        return businesses
+
+    def find_businesses_in_polygon_within_budget(
+            self,
+            polygon: Union[str, dict, GEOSGeometry],
+            budget: SearchBudget,
+    ) -> Tuple[List[Business], Optional[str]]:
+        """
+        Same as find_businesses_in_polygon, but stops once the work budget runs out: it returns the
+        budget.max_rows businesses nearest to the polygon's centroid, or nothing if it ran out of time.
+
+        Args:
+            polygon: GeoJSON Polygon or MultiPolygon in WGS84
+            budget: Limits on rows and wall-clock time (max_expansions doesn't apply)
+
+        Returns:
+            Tuple[List[Business], Optional[str]]: The businesses found, and which limit cut the search short
+                ("rows" or "deadline"), or None if it completed
+
+        Raises:
+            ValueError: If the polygon isn't valid GeoJSON or isn't a polygon
+        """
+        polygon = self._parse_geometry(polygon, ("Polygon", "MultiPolygon"))
+        centroid = polygon.centroid
+        deadline = budget.deadline()
+        businesses = []
+        for alias in sharding.shards_for_bbox(polygon.extent):
+            if deadline is not None and time.monotonic() >= deadline:
+                return [], "deadline"
+            queryset = bbox_filter(Business.objects.using(alias), polygon.extent).filter(
+                location__within=polygon
+            ).annotate(
+                distance_meters=Distance('location', centroid)
+            ).order_by('distance_meters', 'id')
+            if budget.max_rows is not None:
+                queryset = queryset[:budget.max_rows]
+            try:
+                with query_deadline(deadline, using=alias):
+                    businesses.extend(queryset)
+            except OperationalError:
+                # SQLite interrupts the query once the deadline passes (see search/admission.py)
+                if deadline is not None and time.monotonic() >= deadline:
+                    return [], "deadline"
+                raise
+        businesses.sort(key=lambda business: business.distance_meters.m)
+        if budget.max_rows is not None and len(businesses) >= budget.max_rows:
+            return businesses[:budget.max_rows], "rows"
+        return businesses, None
+
+    def find_businesses_along_route(self, route: Union[str, dict, GEOSGeometry], buffer_km: float) -> List[Business]:
+        """
+        Find businesses within a distance of a route.
+        Candidates come from the spatial index, looked up with a buffered box per short piece of the route. The exact
+        distance to the route is computed in python (search/geodesic.py), since SpatiaLite's ellipsoidal
+        distance is only reliable point to point.
+
+        Each business gets `distance_meters` (distance to the route) and `distance_along_route_meters`
+        (how far along the route its closest point is) set on it.
+
+        Args:
+            route: GeoJSON LineString in WGS84
+            buffer_km: Max distance from the route in kilometers
+
+        Returns:
+            List[Business]: Businesses within the buffer, in the order they appear along the route
+
+        Raises:
+            ValueError: If the route isn't valid GeoJSON or isn't a linestring, or the buffer isn't a finite,
+                non-negative number
+        """
+        businesses, _ = self.find_businesses_along_route_within_budget(route, buffer_km, SearchBudget())
+        return businesses
+
+    def find_businesses_along_route_within_budget(
+            self,
+            route: Union[str, dict, GEOSGeometry],
+            buffer_km: float,
+            budget: SearchBudget,
+    ) -> Tuple[List[Business], Optional[str]]:
+        """
+        Same as find_businesses_along_route, but stops once the work budget runs out: it returns the first
+        budget.max_rows businesses along the route, or nothing if it ran out of time.
+
+        Args:
+            route: GeoJSON LineString in WGS84
+            buffer_km: Max distance from the route in kilometers
+            budget: Limits on rows and wall-clock time (max_expansions doesn't apply)
+
+        Returns:
+            Tuple[List[Business], Optional[str]]: The businesses found, and which limit cut the search short
+                ("rows" or "deadline"), or None if it completed
+
+        Raises:
+            ValueError: If the route isn't valid GeoJSON or isn't a linestring, or the buffer isn't a finite,
+                non-negative number
+        """
+        # NaN would slip past a plain < 0 check, and an infinite buffer would make the boxes cover the globe
+        if not math.isfinite(buffer_km) or buffer_km < 0:
+            raise ValueError("buffer_km must be a finite, non-negative number")
+        route = self._parse_geometry(route, ("LineString",))
+        coords = [tuple(coord[:2]) for coord in route.coords]
+        segment_lengths_m = polyline_lengths_m(coords)
+        # One box per short piece of the route, so a long or diagonal route doesn't pull in everything around it
+        bboxes = polyline_bboxes(coords, buffer_km)
+        buffer_m = buffer_km * 1000
+        deadline = budget.deadline()
+
+        aliases = []
+        for bbox in bboxes:
+            aliases += [alias for alias in sharding.shards_for_bbox(bbox) if alias not in aliases]
+
+        # (distance along the route, distance to it, alias, pk). Candidates come back as bare coordinates,
+        # only the ones kept in the end get loaded as businesses.
+        within = []
+        for alias in aliases:
+            seen = set()
+            for start in range(0, len(bboxes), ROUTE_BBOXES_PER_QUERY):
+                if deadline is not None and time.monotonic() >= deadline:
+                    return [], "deadline"
+                candidates = bboxes_filter(
+                    Business.objects.using(alias).order_by(), bboxes[start:start + ROUTE_BBOXES_PER_QUERY]
+                ).values_list(
+                    "pk",
+                    Func(F("location"), function="ST_X", output_field=FloatField()),
+                    Func(F("location"), function="ST_Y", output_field=FloatField()),
+                )
+                try:
+                    with query_deadline(deadline, using=alias):
+                        candidates = list(candidates)
+                except OperationalError:
+                    # SQLite interrupts the query once the deadline passes (see search/admission.py)
+                    if deadline is not None and time.monotonic() >= deadline:
+                        return [], "deadline"
+                    raise
+                for pk, lon, lat in candidates:
+                    if pk not in seen:
+                        seen.add(pk)
+                        distance_m, along_m = locate_on_polyline(lat, lon, coords, segment_lengths_m)
+                        if distance_m <= buffer_m:
+                            within.append((along_m, distance_m, alias, pk))
+
+        within.sort()
+        exhausted = None
+        if budget.max_rows is not None and len(within) >= budget.max_rows:
+            within = within[:budget.max_rows]
+            exhausted = "rows"
+
+        pks_by_alias = {}
+        for _, _, alias, pk in within:
+            pks_by_alias.setdefault(alias, []).append(pk)
+        loaded = {
+            (alias, pk): business
+            for alias, pks in pks_by_alias.items()
+            for pk, business in Business.objects.using(alias).in_bulk(pks).items()
+        }
+        businesses = []
+        for along_m, distance_m, alias, pk in within:
+            business = loaded[(alias, pk)]
+            business.distance_meters = D(m=distance_m)
+            business.distance_along_route_meters = D(m=along_m)
+            businesses.append(business)
+        return businesses, exhausted
+
     def find_businesses_by_location(self, city: str, state: str) -> List[Business]:
         """
         Find all businesses in a specific city and state.
@@ -170,7 +580,13 @@ class BusinessSearcher:
         """
         if not city or not state:
             return []
-            
+
+        try:
+            using = sharding.shard_for_state(state)
+        except ValueError:
+            # No shard holds this state, so there's nothing to find
+            return []
+
         query = """
         SELECT *
         FROM search_business
@@ -179,10 +595,10 @@ class BusinessSearcher:
         ORDER BY name
         """
         
-        return self._execute_sql_query(query, (city.strip(), state.strip()))
+        return self._execute_sql_query(query, (city.strip(), state.strip()), using=using)
 
     @staticmethod
-    def _execute_sql_query(query: str, params: tuple = None) -> List[Business]:
+    def _execute_sql_query(query: str, params: tuple = None, using: Optional[str] = None) -> List[Business]:
         """
         Execute a parameterized SQL query and return Business objects.
         Assumes the query is a SELECT statement that returns Business objects.
@@ -193,12 +609,13 @@ class BusinessSearcher:
         Args:
             query: The SQL query with %s placeholders
             params: Tuple of parameters to substitute into the query
+            using: Database alias to run the query against. Defaults to the router's choice.
             
         Returns:
             List[Business]: List of Business objects from the query results
         """
         # Assumes that the number of results returned is fairly small. Worry about perf enhancements later.
-        return list(Business.objects.raw(query, params or ()))
+        return list(Business.objects.raw(query, params or (), using=using))
 
     # So I notice that this pulls a few results from outside the state as well.
     # Not sure if this is expected behavior in spatialite.
@@ -218,7 +635,11 @@ class BusinessSearcher:
             # print("Please specify a state")
             return []
 
-        queryset = Business.objects.all()
+        try:
+            # City/state lookups only ever touch the one shard holding the state
+            queryset = Business.objects.using(sharding.shard_for_state(state))
+        except ValueError:
+            return []
         if state:
             queryset = queryset.filter(state=state)
         if city:
@@ -227,8 +648,217 @@ class BusinessSearcher:
         # Assumes that the number of results returned is fairly small. Worry about perf enhancements later.
         return list(queryset)
 
-# Easier to type!
-find_businesses_incrementally = BusinessSearcher().find_businesses_incrementally
-find_businesses_by_location = BusinessSearcher().find_businesses_by_location
-get_businesses_by_city_state = BusinessSearcher().get_businesses_by_city_state
+    def find_businesses_combined(
+            self,
+            lat: float,
+            lon: float,
+            query_radius_km: int,
+            city: Optional[str],
+            state: Optional[str],
+            budget: SearchBudget,
+    ) -> Tuple[int, List[Business], Optional[str]]:
+        """
+        Run the city/state search and the incremental radius search together, in a single SQL statement.
+
+        The statement picks the smallest radius of the incremental walk that has any business in it (the same radius
+        find_businesses_incrementally would stop at), unions those businesses with the city/state matches, dedupes
+        them by id and orders them by distance from the center, then name, then id.
+        Each business gets `match_reason` ("radius", "city_state" or "both") and `distance_meters` set on it.
+
+        Args:
+            lat: Center point latitude (WGS84)
+            lon: Center point longitude (WGS84)
+            query_radius_km: Query radius in kilometers
+            city: City (exact match), or None
+            state: State code (exact match), or None for a radius search only
+            budget: Limits on expansions, rows and wall-clock time
+
+        Returns:
+            Tuple[int, List[Business], Optional[str]]: The radius used (0 if nothing was found within any radius),
+                the businesses, and which limit cut the search short ("expansions", "rows" or "deadline"), or None
+        """
+        if sharding.is_sharded():
+            # The two searches hit different shards, so they can't share a statement
+            return self._find_businesses_combined_merged(lat, lon, query_radius_km, city, state, budget)
+        if lat is not None and lon is not None and centroids.is_centroid(lat, lon):
+            # The radius part is an indexed read of the materialized centroid table (see search/centroids.py),
+            # cheaper than the distance scan of the combined statement
+            return self._find_businesses_combined_merged(lat, lon, query_radius_km, city, state, budget)
+
+        radii_km = self._radii_km(query_radius_km)
+        exhausted = None
+        if budget.max_expansions is not None and len(radii_km) > budget.max_expansions:
+            radii_km = radii_km[:budget.max_expansions]
+            exhausted = "expansions"
+
+        query, params = self._compile_combined_query(lat, lon, radii_km, city, state, budget.max_rows)
+        deadline = budget.deadline()
+        try:
+            with query_deadline(deadline):
+                with connection.cursor() as cursor:
+                    cursor.execute(query, params)
+                    rows = cursor.fetchall()
+        except OperationalError:
+            # SQLite interrupts the query once the deadline passes (see search/admission.py)
+            if deadline is not None and time.monotonic() >= deadline:
+                return 0, [], "deadline"
+            raise
+
+        radius_km = 0
+        businesses = []
+        for business_id, name, city_name, state_code, x, y, distance_meters, match_reason, radius_meters in rows:
+            business = Business.from_db(
+                connection.alias,
+                ["id", "name", "city", "state", "location"],
+                [business_id, name, city_name, state_code, Point(x, y, srid=4326)],
+            )
+            business.distance_meters = D(m=distance_meters) if distance_meters is not None else None
+            business.match_reason = match_reason
+            businesses.append(business)
+            if radius_meters is not None:
+                radius_km = radius_meters / 1000
+                if float(radius_km).is_integer():
+                    radius_km = int(radius_km)
+
+        if radius_km:
+            # The radius walk found something, so it never ran into the expansions limit
+            exhausted = None
+        if budget.max_rows is not None and len(businesses) >= budget.max_rows:
+            exhausted = "rows"
+        return radius_km, businesses, exhausted
+
+    @staticmethod
+    def _compile_combined_query(
+            lat: float,
+            lon: float,
+            radii_km: Sequence[Union[int, float]],
+            city: Optional[str],
+            state: Optional[str],
+            max_rows: Optional[int],
+    ) -> Tuple[str, list]:
+        """
+        Build the single statement behind find_businesses_combined.
 
+        Returns:
+            Tuple[str, list]: The SQL (with %s placeholders) and its parameters. Each row is
+                (id, name, city, state, x, y, distance_meters, match_reason, radius_meters)
+        """
+        table = Business._meta.db_table
+        # Same distance GeoDjango's distance_lte and Distance() use on geodetic fields (sphere, NULL means 0)
+        distance_sql = "COALESCE(ST_Distance({column}, MakePoint(%s, %s, 4326), 0), 0)"
+
+        params = []
+        ctes = []
+        branches = []
+        has_center = lat is not None and lon is not None
+        if has_center:
+            ctes.append(f"radii(radius_meters) AS (VALUES {', '.join(['(%s)'] * len(radii_km))})")
+            params += [r * 1000 for r in radii_km]
+
+            # Only the rows inside the bounding box of the largest radius get a distance computed
+            lookup, lookup_params = index_lookup(Business, circle_bbox(lat, lon, max(radii_km)))
+            ctes.append(f"""radius_candidates AS (
+                SELECT id, {distance_sql.format(column='location')} AS distance_meters
+                FROM {table}
+                WHERE id IN ({lookup})
+            )""")
+            params += [lon, lat] + lookup_params
+
+            # Where the incremental walk would stop: the smallest radius with any business in it
+            ctes.append("""chosen_radius AS (
+                SELECT MIN(radius_meters) AS radius_meters FROM radii
+                WHERE radius_meters >= (SELECT MIN(distance_meters) FROM radius_candidates)
+            )""")
+            branches.append("""
+                SELECT id, 'radius' AS reason FROM radius_candidates
+                WHERE distance_meters <= (SELECT radius_meters FROM chosen_radius)
+            """)
+
+        if state:
+            branches.append(f"SELECT id, 'city_state' AS reason FROM {table} WHERE state = %s" + (" AND city = %s" if city else ""))
+            params += [state] + ([city] if city else [])
+
+        ctes.append(f"matches AS ({' UNION ALL '.join(branches)})")
+
+        select_params = [lon, lat] if has_center else []
+        query = f"""
+            WITH {', '.join(ctes)}
+            SELECT
+                b.id, b.name, b.city, b.state, X(b.location), Y(b.location),
+                {distance_sql.format(column='b.location') if has_center else 'NULL'} AS distance_meters,
+                CASE WHEN COUNT(DISTINCT m.reason) > 1 THEN 'both' ELSE MIN(m.reason) END AS match_reason,
+                {'(SELECT radius_meters FROM chosen_radius)' if has_center else 'NULL'} AS radius_meters
+            FROM matches m
+            JOIN {table} b ON b.id = m.id
+            GROUP BY b.id
+            ORDER BY distance_meters IS NULL, distance_meters, b.name, b.id
+        """
+        params += select_params
+        if max_rows is not None:
+            query += " LIMIT %s"
+            params.append(max_rows)
+        return query, params
+
+    def _find_businesses_combined_merged(
+            self,
+            lat: float,
+            lon: float,
+            query_radius_km: int,
+            city: Optional[str],
+            state: Optional[str],
+            budget: SearchBudget,
+    ) -> Tuple[int, List[Business], Optional[str]]:
+        """
+        find_businesses_combined with the two searches run separately, then merged the same way the combined
+        statement does it. Used on the sharded store, and for searches centered on a city centroid.
+        """
+        radius_km, radius_businesses, exhausted = self.find_businesses_incrementally_within_budget(lat, lon, query_radius_km, budget)
+        city_state_businesses = self.get_businesses_by_city_state(city, state) if state else []
+
+        # Ids are only unique per database once the store is sharded, so dedupe on (database, id)
+        merged = {}
+        for reason, businesses in (("radius", radius_businesses), ("city_state", city_state_businesses)):
+            for business in businesses:
+                key = (business._state.db, business.pk)
+                if key in merged:
+                    merged[key].match_reason = "both"
+                    continue
+                business.match_reason = reason
+                merged[key] = business
+
+        for business in merged.values():
+            if getattr(business, "distance_meters", None) is not None:
+                continue
+            if lat is not None and lon is not None:
+                # City/state matches outside the radius don't come with a distance, compute it the way the SQL does
+                business.distance_meters = D(m=spherical_distance_m(lat, lon, business.location.y, business.location.x))
+            else:
+                business.distance_meters = None
+        businesses = sorted(
+            merged.values(),
+            key=lambda b: (b.distance_meters is None, b.distance_meters.m if b.distance_meters else 0, b.name, b.pk),
+        )
+        if budget.max_rows is not None and len(businesses) > budget.max_rows:
+            businesses = businesses[:budget.max_rows]
+            exhausted = "rows"
+        return radius_km, businesses, exhausted
+
+# Concurrent identical searches (e.g. a popular shared map link) share one execution.
+# See search/singleflight.py.
+# Coalescing sits in front of admission control (search/admission.py), so searches waiting on an identical
+# in-flight one don't hold a slot.
+search_flight = SingleFlight(timeout=settings.SEARCH_COALESCE_TIMEOUT_SECONDS)
+search_admission = AdmissionController.from_settings()
+coalescing_searcher = CoalescingSearcher(AdmittedSearcher(BusinessSearcher(), search_admission), search_flight)
+
+# Easier to type!
+find_businesses_incrementally = coalescing_searcher.find_businesses_incrementally
+find_businesses_incrementally_within_budget = coalescing_searcher.find_businesses_incrementally_within_budget
+find_businesses_by_location = coalescing_searcher.find_businesses_by_location
+get_businesses_by_city_state = coalescing_searcher.get_businesses_by_city_state
+find_businesses_in_polygon = coalescing_searcher.find_businesses_in_polygon
+find_businesses_along_route = coalescing_searcher.find_businesses_along_route
+find_businesses_in_polygon_within_budget = coalescing_searcher.find_businesses_in_polygon_within_budget
+find_businesses_along_route_within_budget = coalescing_searcher.find_businesses_along_route_within_budget
+find_businesses_near_city_center = coalescing_searcher.find_businesses_near_city_center
+find_businesses_combined = coalescing_searcher.find_businesses_combined
@@ -13,3 +13,21 @@ class BusinessSerializer(serializers.ModelSerializer):
 			"state",
 			"location",
 		]
+
+
+class PlannedBusinessSerializer(BusinessSerializer):
+	"""
+	Results of the combined city/state and radius search, with why and how far away each business matched.
+	"""
+	match_reason = serializers.CharField(read_only=True)
+	distance_meters = serializers.SerializerMethodField()
+
+	class Meta(BusinessSerializer.Meta):
+		fields = BusinessSerializer.Meta.fields + [
+			"match_reason",
+			"distance_meters",
+		]
+
+	def get_distance_meters(self, business):
+		distance = getattr(business, "distance_meters", None)
+		return None if distance is None else round(distance.m, 1)
@@ -0,0 +1,173 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from django.conf import settings
+from django.contrib.gis.db.models.functions import Distance
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from search.admission import query_deadline
+from search.geodesic import BBox, bboxes_intersect, circle_bbox
+from search.models import Business
+from search.spatial_index import index_extent
+from typing import List, Optional
+
+# Shared by every fanned out search. Django connections are per thread, so long-lived workers keep their shard
+# connections (with SpatiaLite loaded) open from one search to the next instead of reconnecting every time.
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def is_sharded() -> bool:
+    return bool(settings.BUSINESS_SHARDS)
+
+
+def business_aliases() -> List[str]:
+    """
+    Database aliases that hold business rows.
+
+    Returns:
+        List[str]: The shard aliases when sharding is on, otherwise just the default alias
+    """
+    return list(settings.BUSINESS_SHARDS) or [DEFAULT_DB_ALIAS]
+
+
+def shard_for_state(state: str) -> str:
+    """
+    Find the database alias holding businesses for a state.
+
+    Args:
+        state: State code (case-insensitive, e.g., 'CA' for California)
+
+    Returns:
+        str: The shard alias, or the default alias when sharding is off
+
+    Raises:
+        ValueError: If sharding is on and no shard holds the state
+    """
+    if not is_sharded():
+        return DEFAULT_DB_ALIAS
+    state = (state or "").strip().upper()
+    for alias, states in settings.BUSINESS_SHARDS.items():
+        if state in states:
+            return alias
+    raise ValueError(f"No shard configured for state {state!r}")
+
+
+def shard_extent(alias: str) -> Optional[BBox]:
+    """
+    Bounding box of all business locations stored in a shard.
+
+    Computed from the data rather than the state borders, since locations don't always sit inside their state.
+    Read from the shard's spatial index on every call rather than cached, so a load by another process
+    (load_businesses) is seen by the very next search.
+
+    Args:
+        alias: Shard database alias
+
+    Returns:
+        Optional[BBox]: (min_lon, min_lat, max_lon, max_lat), or None if the shard is empty
+    """
+    return index_extent(Business, alias)
+
+
+def shards_for_circle(lat: float, lon: float, radius_km: float) -> List[str]:
+    """
+    Shards whose extents intersect the bounding box of a search circle.
+
+    Args:
+        lat: Center point latitude (WGS84)
+        lon: Center point longitude (WGS84)
+        radius_km: Search radius in kilometers
+
+    Returns:
+        List[str]: Shard aliases worth querying
+    """
+    return shards_for_bbox(circle_bbox(lat, lon, radius_km))
+
+
+def shards_for_bbox(bbox: BBox) -> List[str]:
+    """
+    Shards whose extents intersect a bounding box.
+
+    Args:
+        bbox: (min_lon, min_lat, max_lon, max_lat)
+
+    Returns:
+        List[str]: Shard aliases worth querying
+    """
+    if not is_sharded():
+        return business_aliases()
+    aliases = []
+    for alias in business_aliases():
+        extent = shard_extent(alias)
+        if extent and bboxes_intersect(extent, bbox):
+            aliases.append(alias)
+    return aliases
+
+
+def _query_shard(alias: str, lat: float, lon: float, radius_km: float, max_rows: Optional[int], deadline: Optional[float]) -> List[Business]:
+    point = Point(lon, lat, srid=4326)
+    businesses = Business.objects.using(alias).filter(
+        location__distance_lte=(point, D(km=radius_km))
+    ).annotate(
+        distance_meters=Distance("location", point)
+    ).order_by("distance_meters")
+    if max_rows is not None:
+        businesses = businesses[:max_rows]
+    with query_deadline(deadline, using=alias):
+        return list(businesses)
+
+
+def _shard_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(1, settings.BUSINESS_SHARD_WORKERS), thread_name_prefix="shard-search")
+        return _executor
+
+
+def _query_shard_in_worker(alias: str, lat: float, lon: float, radius_km: float, max_rows: Optional[int], deadline: Optional[float]) -> List[Business]:
+    try:
+        return _query_shard(alias, lat, lon, radius_km, max_rows, deadline)
+    except BaseException:
+        # The connection stays with this worker thread for later searches, don't keep it around in an unknown state
+        connections[alias].close()
+        raise
+
+
+def find_businesses_within_radius(
+        lat: float,
+        lon: float,
+        radius_km: float,
+        max_rows: Optional[int] = None,
+        deadline: Optional[float] = None,
+) -> List[Business]:
+    """
+    Fan a radius search out to the shards that could hold matches, in parallel, and merge by distance.
+
+    Args:
+        lat: Center point latitude (WGS84)
+        lon: Center point longitude (WGS84)
+        radius_km: Search radius in kilometers
+        max_rows: Only return this many of the nearest businesses
+        deadline: time.monotonic() value after which shard queries get interrupted (see search/admission.py)
+
+    Returns:
+        List[Business]: Businesses within the radius from all shards, nearest first
+    """
+    aliases = shards_for_circle(lat, lon, radius_km)
+    if not aliases:
+        return []
+
+    if len(aliases) == 1:
+        # No point paying for a thread when only one shard is involved
+        return _query_shard(aliases[0], lat, lon, radius_km, max_rows, deadline)
+
+    executor = _shard_executor()
+    per_shard = list(executor.map(lambda alias: _query_shard_in_worker(alias, lat, lon, radius_km, max_rows, deadline), aliases))
+
+    businesses = [business for shard_businesses in per_shard for business in shard_businesses]
+    businesses.sort(key=lambda business: business.distance_meters.m)
+    return businesses if max_rows is None else businesses[:max_rows]
@@ -0,0 +1,168 @@
+"""
+In-process request coalescing ("single-flight").
+
+When many clients send the exact same search at the same time, only the first one (the leader) runs it.
+The others wait for the leader and share its result, or its exception.
+"""
+import functools
+import threading
+
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class SingleFlightTimeout(TimeoutError):
+    """
+    Raised to a waiter when the in-flight call it joined didn't finish in time.
+    """
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+def _copy_error(error: BaseException) -> BaseException:
+    """
+    A copy of a shared call's exception, for one waiter to raise.
+
+    Raising the same exception instance in several threads at once tangles its __traceback__, so only the leader
+    raises the original. The copy keeps the type, args and attributes (e.g. Overloaded.status_code), so callers
+    handle it the same way.
+    """
+    try:
+        copied = type(error).__new__(type(error), *error.args)
+        copied.__dict__.update(error.__dict__)
+        return copied
+    except Exception:
+        # Exception types that can't be rebuilt from their args
+        return RuntimeError(f"Identical in-flight search failed: {error!r}")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into a single execution.
+
+    Attributes:
+        timeout: Default number of seconds a waiter waits for the in-flight call before giving up
+    """
+
+    def __init__(self, timeout: float = 30.0):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._stats = {"executions": 0, "coalesced": 0, "timeouts": 0, "errors": 0}
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """
+        Run fn, unless a call with the same key is already in flight, in which case wait for it and share its result.
+        Results are shared between callers as is, so treat them as read-only.
+
+        Args:
+            key: Identifies identical calls (e.g. the normalized search parameters)
+            fn: The call to make
+            timeout: Seconds to wait for an in-flight call. Defaults to self.timeout.
+
+        Returns:
+            Any: Whatever fn returned
+
+        Raises:
+            SingleFlightTimeout: If this caller joined an in-flight call that didn't finish within the timeout
+            Exception: Whatever fn raised, re-raised to every caller that shared the call (waiters get a copy,
+                chained to the original)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+                self._stats["executions"] += 1
+            else:
+                leader = False
+                call.waiters += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+                with self._lock:
+                    self._stats["errors"] += 1
+            finally:
+                # Later callers start a new execution rather than getting this (soon stale) result
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        elif not call.done.wait(self.timeout if timeout is None else timeout):
+            with self._lock:
+                call.waiters -= 1
+                self._stats["timeouts"] += 1
+            raise SingleFlightTimeout("Timed out waiting for an identical in-flight search")
+        else:
+            with self._lock:
+                self._stats["coalesced"] += 1
+
+        if call.error is not None:
+            if leader:
+                raise call.error
+            raise _copy_error(call.error) from call.error
+        return call.result
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Counters since startup.
+
+        Returns:
+            Dict[str, int]: executions (calls actually run), coalesced (calls that shared another's result, i.e.
+                executions saved), timeouts (waiters that gave up), errors (executions that raised), in_flight,
+                waiting (callers waiting on an in-flight call right now)
+        """
+        with self._lock:
+            return dict(
+                self._stats,
+                in_flight=len(self._calls),
+                waiting=sum(call.waiters for call in self._calls.values()),
+            )
+
+
+class CoalescingSearcher:
+    """
+    Wraps a BusinessSearcher so concurrent identical searches share one execution.
+
+    The search methods are keyed on their name and arguments, so callers should normalize
+    (parse, strip, convert) parameters before searching.
+    """
+    COALESCED_METHODS = frozenset({
+        "find_businesses_incrementally",
+        "find_businesses_incrementally_within_budget",
+        "find_businesses_by_location",
+        "get_businesses_by_city_state",
+        "find_businesses_in_polygon",
+        "find_businesses_along_route",
+        "find_businesses_in_polygon_within_budget",
+        "find_businesses_along_route_within_budget",
+        "find_businesses_near_city_center",
+        "find_businesses_combined",
+    })
+
+    def __init__(self, searcher, flight: Optional[SingleFlight] = None):
+        self.searcher = searcher
+        self.flight = flight or SingleFlight()
+
+    def __getattr__(self, name: str):
+        method = getattr(self.searcher, name)
+        if name not in self.COALESCED_METHODS:
+            return method
+
+        @functools.wraps(method)
+        def coalesced(*args, **kwargs):
+            key = (name, args, tuple(sorted(kwargs.items())))
+            try:
+                hash(key)
+            except TypeError:
+                # e.g. a decoded GeoJSON dict, just run it
+                return method(*args, **kwargs)
+            return self.flight.do(key, lambda: method(*args, **kwargs))
+        return coalesced
@@ -0,0 +1,108 @@
+from django.db import connections
+from django.db.models import Model, QuerySet
+from django.db.models.expressions import RawSQL
+
+from search.geodesic import BBox
+from typing import List, Optional, Sequence, Tuple, Type
+
+
+def index_table(model: Type[Model], field_name: str = "location") -> str:
+    """
+    Name of the R*Tree virtual table SpatiaLite keeps the spatial index of a geometry field in.
+
+    Args:
+        model: Model with a spatially indexed geometry field
+        field_name: Name of the indexed geometry field
+
+    Returns:
+        str: idx_<table>_<geometry column>
+    """
+    opts = model._meta
+    return f"idx_{opts.db_table}_{opts.get_field(field_name).column}"
+
+
+def index_lookup(model: Type[Model], bbox: BBox, field_name: str = "location") -> Tuple[str, List[float]]:
+    """
+    SQL selecting the ids of the rows whose geometry falls inside a bounding box, through the R*Tree spatial index.
+    Use it as the right-hand side of `id IN (...)`.
+
+    Args:
+        model: Model with a spatially indexed geometry field
+        bbox: (min_lon, min_lat, max_lon, max_lat)
+        field_name: Name of the indexed geometry field
+
+    Returns:
+        Tuple[str, List[float]]: The SQL (with %s placeholders) and its parameters
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    return (
+        f"SELECT pkid FROM {index_table(model, field_name)} WHERE xmin <= %s AND xmax >= %s AND ymin <= %s AND ymax >= %s",
+        [max_lon, min_lon, max_lat, min_lat],
+    )
+
+
+def index_extent(model: Type[Model], using: str, field_name: str = "location") -> Optional[BBox]:
+    """
+    Bounding box of every geometry in the spatial index, read from the R*Tree (whose bounds are rounded outwards,
+    so it never comes out smaller than the data).
+
+    Args:
+        model: Model with a spatially indexed geometry field
+        using: Database alias to read from
+        field_name: Name of the indexed geometry field
+
+    Returns:
+        Optional[BBox]: (min_lon, min_lat, max_lon, max_lat), or None if the table is empty
+    """
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT MIN(xmin), MIN(ymin), MAX(xmax), MAX(ymax) "
+            f"FROM {connection.ops.quote_name(index_table(model, field_name))}"
+        )
+        extent = cursor.fetchone()
+    return None if extent[0] is None else tuple(extent)
+
+
+def bbox_filter(queryset: QuerySet, bbox: BBox, field_name: str = "location") -> QuerySet:
+    """
+    Narrow a queryset to rows whose geometry falls inside a bounding box, using the SpatiaLite
+    R*Tree spatial index instead of scanning the table.
+
+    Args:
+        queryset: Queryset over a model with a spatially indexed geometry field
+        bbox: (min_lon, min_lat, max_lon, max_lat)
+        field_name: Name of the indexed geometry field
+
+    Returns:
+        QuerySet: The queryset restricted to candidates inside the bounding box
+    """
+    return bboxes_filter(queryset, [bbox], field_name)
+
+
+def bboxes_filter(queryset: QuerySet, bboxes: Sequence[BBox], field_name: str = "location") -> QuerySet:
+    """
+    Narrow a queryset to rows whose geometry falls inside any of several bounding boxes, using the SpatiaLite
+    R*Tree spatial index instead of scanning the table.
+
+    The R*Tree can only answer one box per lookup (it can't use OR'ed constraints), so every box gets its own
+    indexed lookup and the results are UNIONed. SQLite caps a compound SELECT at 500 parts by default, so pass
+    fewer boxes than that per call.
+
+    Args:
+        queryset: Queryset over a model with a spatially indexed geometry field
+        bboxes: (min_lon, min_lat, max_lon, max_lat) boxes
+        field_name: Name of the indexed geometry field
+
+    Returns:
+        QuerySet: The queryset restricted to candidates inside the bounding boxes
+    """
+    if not bboxes:
+        return queryset.none()
+    lookups = []
+    params = []
+    for bbox in bboxes:
+        lookup, lookup_params = index_lookup(queryset.model, bbox, field_name)
+        lookups.append(lookup)
+        params += lookup_params
+    return queryset.filter(pk__in=RawSQL(" UNION ".join(lookups), params))
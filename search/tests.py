@@ -1,3 +1,991 @@
-from django.test import TestCase
+import math
+import random
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+
+from django.contrib.gis.geos import Point
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from search import admin, centroids, density, geohash, reload, sharding
+from search.admission import CITY_STATE, RADIUS, AdmissionController, Overloaded, SearchBudget, query_deadline
+from search.differential import QueryCase, oracle_radius, run_differential
+from search.geodesic import (
+    MEAN_EARTH_RADIUS_M,
+    circle_bbox,
+    locate_on_polyline,
+    polyline_bboxes,
+    polyline_lengths_m,
+    spherical_distance_m,
+)
+from search.models import Business, CityCentroid, DensityCell
+from search.routers import BusinessShardRouter
+from search.search_helper import BusinessSearcher
+from search.singleflight import SingleFlight, SingleFlightTimeout
+from search.spatial_index import bboxes_filter, index_table
+
+
+def _destination(lat: float, lon: float, bearing_deg: float, distance_m: float):
+    """
+    Point reached going distance_m from (lat, lon) along a great circle, on the sphere the database measures on.
+    """
+    delta = distance_m / MEAN_EARTH_RADIUS_M
+    phi1, lambda1, theta = math.radians(lat), math.radians(lon), math.radians(bearing_deg)
+    phi2 = math.asin(math.sin(phi1) * math.cos(delta) + math.cos(phi1) * math.sin(delta) * math.cos(theta))
+    lambda2 = lambda1 + math.atan2(
+        math.sin(theta) * math.sin(delta) * math.cos(phi1), math.cos(delta) - math.sin(phi1) * math.sin(phi2)
+    )
+    return math.degrees(phi2), (math.degrees(lambda2) + 540.0) % 360.0 - 180.0
+
+
+class DifferentialSearchTest(TestCase):
+    """
+    Every search engine should return the same businesses as the brute-force geodesic oracle.
+    """
+
+    def test_engines_match_oracle(self):
+        for seed in range(3):
+            report = run_differential(size=200, queries=20, seed=seed)
+            self.assertEqual(report.mismatches, [], msg=report.format())
+
+    def test_sphere_and_ellipsoid_disagreeing_is_a_boundary_case(self):
+        # One degree north of null island: 110.57 km on the ellipsoid, 111.19 km on the sphere
+        rows = [(("default", 1), 1.0, 0.0, "", ""), (("default", 2), 0.5, 0.0, "", "")]
+        case = QueryCase(kind="radius", label="equator", lat=0.0, lon=0.0, radius_km=110.9)
+        self.assertEqual(oracle_radius(rows, case, relative_tolerance=0), ({("default", 2)}, {("default", 1)}))
+
+
+class CircleBBoxTest(SimpleTestCase):
+    """
+    circle_bbox prefilters every radius search, so it must never cut off any part of the circle.
+    """
+
+    def test_contains_the_whole_circle(self):
+        rng = random.Random(0)
+        for _ in range(200):
+            lat, lon = rng.uniform(-80, 80), rng.uniform(-170, 170)
+            radius_km = rng.choice([0.5, 1, 5, 25, 100, 500])
+            min_lon, min_lat, max_lon, max_lat = circle_bbox(lat, lon, radius_km)
+            for bearing in range(0, 360, 5):
+                edge_lat, edge_lon = _destination(lat, lon, bearing, radius_km * 1000)
+                self.assertTrue(min_lat <= edge_lat <= max_lat, (lat, lon, radius_km, bearing))
+                if min_lon > -180.0 or max_lon < 180.0:
+                    self.assertTrue(min_lon <= edge_lon <= max_lon, (lat, lon, radius_km, bearing))
+
+    def test_falls_back_to_every_longitude_at_the_poles_and_antimeridian(self):
+        self.assertEqual(circle_bbox(89.9, 10, 50)[0::2], (-180.0, 180.0))
+        self.assertEqual(circle_bbox(0, 179.99, 50)[0::2], (-180.0, 180.0))
+
+
+TEST_SHARDS = {"shard_west": ["CA", "OR"], "shard_east": ["NY"]}
+
+
+@override_settings(BUSINESS_SHARDS=TEST_SHARDS)
+class ShardingTest(SimpleTestCase):
+    """
+    Routing of business rows to shards, and pruning of the shards a radius search fans out to.
+    """
+
+    def test_shard_for_state(self):
+        self.assertEqual(sharding.shard_for_state("ca"), "shard_west")
+        self.assertEqual(sharding.shard_for_state(" NY "), "shard_east")
+        with self.assertRaises(ValueError):
+            sharding.shard_for_state("TX")
+
+    @override_settings(BUSINESS_SHARDS={})
+    def test_unsharded_store_is_the_default_database(self):
+        self.assertFalse(sharding.is_sharded())
+        self.assertEqual(sharding.shard_for_state("TX"), DEFAULT_DB_ALIAS)
+        self.assertEqual(sharding.business_aliases(), [DEFAULT_DB_ALIAS])
+        self.assertEqual(sharding.shards_for_circle(37.77, -122.42, 10), [DEFAULT_DB_ALIAS])
+
+    def test_router_routes_businesses_by_state(self):
+        router = BusinessShardRouter()
+        self.assertEqual(router.db_for_write(Business, instance=Business(state="OR")), "shard_west")
+        self.assertEqual(router.db_for_read(Business, instance=Business(state="NY")), "shard_east")
+        # Queries without an instance pick their shard explicitly
+        self.assertIsNone(router.db_for_read(Business))
+        self.assertIsNone(router.db_for_write(CityCentroid, instance=CityCentroid(state="OR")))
+
+    def test_router_allow_migrate(self):
+        router = BusinessShardRouter()
+        self.assertTrue(router.allow_migrate("shard_west", "search", model_name="business"))
+        self.assertFalse(router.allow_migrate("shard_west", "search", model_name="citycentroid"))
+        self.assertFalse(router.allow_migrate("shard_west", "auth", model_name="user"))
+        self.assertTrue(router.allow_migrate(DEFAULT_DB_ALIAS, "search", model_name="business"))
+
+    def test_router_allow_relation(self):
+        router = BusinessShardRouter()
+        west, other_west, east, default = Business(), Business(), Business(), CityCentroid()
+        west._state.db, other_west._state.db, east._state.db, default._state.db = "shard_west", "shard_west", "shard_east", DEFAULT_DB_ALIAS
+        self.assertTrue(router.allow_relation(west, other_west))
+        self.assertFalse(router.allow_relation(west, east))
+        self.assertFalse(router.allow_relation(west, default))
+
+    def test_radius_search_only_fans_out_to_intersecting_shards(self):
+        extents = {"shard_west": (-124.4, 32.5, -116.5, 46.2), "shard_east": (-79.7, 40.5, -71.9, 45.0)}
+        with mock.patch.object(sharding, "shard_extent", side_effect=extents.get):
+            self.assertEqual(sharding.shards_for_circle(37.77, -122.42, 10), ["shard_west"])
+            self.assertEqual(sharding.shards_for_circle(40.71, -74.0, 10), ["shard_east"])
+            self.assertEqual(sharding.shards_for_circle(39.74, -104.99, 10), [])
+            self.assertEqual(sharding.shards_for_bbox((-130, 30, -60, 50)), ["shard_west", "shard_east"])
+
+    def test_empty_shards_are_skipped(self):
+        with mock.patch.object(sharding, "shard_extent", return_value=None):
+            self.assertEqual(sharding.shards_for_bbox((-180, -90, 180, 90)), [])
+
+
+class ShardExtentTest(TestCase):
+    """
+    Shard extents come straight from the spatial index, so writes from other processes are seen right away.
+    """
+
+    def test_extent_follows_the_data(self):
+        self.assertIsNone(sharding.shard_extent(DEFAULT_DB_ALIAS))
+        for lon, lat in [(-124.4, 32.5), (-116.5, 46.2)]:
+            Business.objects.create(name="West", city="", state="CA", location=Point(lon, lat, srid=4326))
+        # The R*Tree stores 32 bit floats, rounded outwards
+        for actual, expected, outwards in zip(sharding.shard_extent(DEFAULT_DB_ALIAS), (-124.4, 32.5, -116.5, 46.2), (-1, -1, 1, 1)):
+            self.assertAlmostEqual(actual, expected, places=4)
+            self.assertGreaterEqual((actual - expected) * outwards, 0)
+
+
+class RouteGeometryTest(SimpleTestCase):
+    """
+    The pure python route helpers behind find_businesses_along_route.
+    """
+
+    def test_locate_on_polyline(self):
+        coords = [(0.0, 0.0), (1.0, 0.0), (1.0, 1.0)]
+        lengths = polyline_lengths_m(coords)
+        self.assertEqual(len(lengths), 2)
+
+        # On a vertex
+        distance_m, along_m = locate_on_polyline(0.0, 1.0, coords, lengths)
+        self.assertAlmostEqual(distance_m, 0.0, places=3)
+        self.assertAlmostEqual(along_m, lengths[0], delta=1.0)
+
+        # Abeam the middle of the first segment, ~1.1 km north of it
+        distance_m, along_m = locate_on_polyline(0.01, 0.5, coords, lengths)
+        self.assertAlmostEqual(distance_m, spherical_distance_m(0.0, 0.5, 0.01, 0.5), delta=15)
+        self.assertAlmostEqual(along_m, lengths[0] / 2, delta=100)
+
+        # Past the end, the closest point is the last vertex
+        distance_m, along_m = locate_on_polyline(1.5, 1.0, coords, lengths)
+        self.assertAlmostEqual(along_m, sum(lengths), delta=1.0)
+        self.assertAlmostEqual(distance_m, spherical_distance_m(1.0, 1.0, 1.5, 1.0), delta=0.01 * distance_m)
+
+    def test_locate_on_polyline_across_the_antimeridian(self):
+        coords = [(179.5, 0.0), (-179.5, 0.0)]
+        distance_m, along_m = locate_on_polyline(0.0, 180.0, coords)
+        self.assertAlmostEqual(distance_m, 0.0, places=3)
+        self.assertAlmostEqual(along_m, polyline_lengths_m(coords)[0] / 2, delta=100)
+
+    def test_polyline_bboxes_contain_the_buffered_route(self):
+        coords = [(-120.0, 35.0), (-75.0, 45.0), (-74.0, 30.0)]
+        buffer_km = 5
+        boxes = polyline_bboxes(coords, buffer_km)
+        for (lon1, lat1), (lon2, lat2) in zip(coords, coords[1:]):
+            for step in range(101):
+                lat, lon = lat1 + (lat2 - lat1) * step / 100, lon1 + (lon2 - lon1) * step / 100
+                for bearing in range(0, 360, 15):
+                    edge_lat, edge_lon = _destination(lat, lon, bearing, buffer_km * 1000)
+                    self.assertTrue(
+                        any(box[0] <= edge_lon <= box[2] and box[1] <= edge_lat <= box[3] for box in boxes),
+                        (lat, lon, bearing),
+                    )
+
+    def test_polyline_bboxes_hug_diagonal_routes(self):
+        coords = [(-120.0, 35.0), (-75.0, 45.0)]
+        boxes = polyline_bboxes(coords, 1)
+        covered = sum((box[2] - box[0]) * (box[3] - box[1]) for box in boxes)
+        # A single box around the route would cover the whole 45 x 10 degree rectangle
+        self.assertLess(covered, 0.05 * 45 * 10)
+
+    def test_polyline_bboxes_of_a_single_point(self):
+        self.assertEqual(polyline_bboxes([(10.0, 20.0)], 5), [circle_bbox(20.0, 10.0, 5)])
+
+
+class ParseGeometryTest(SimpleTestCase):
+
+    def test_geojson_defaults_to_wgs84(self):
+        geometry = BusinessSearcher._parse_geometry({"type": "LineString", "coordinates": [[0, 0], [1, 1]]}, ("LineString",))
+        self.assertEqual(geometry.srid, 4326)
+
+    def test_rejects_other_srids(self):
+        with self.assertRaises(ValueError):
+            BusinessSearcher._parse_geometry("SRID=3857;LINESTRING(0 0, 100000 100000)", ("LineString",))
+
+    def test_rejects_other_geometry_types(self):
+        with self.assertRaises(ValueError):
+            BusinessSearcher._parse_geometry('{"type": "Point", "coordinates": [0, 0]}', ("Polygon", "MultiPolygon"))
+        with self.assertRaises(ValueError):
+            BusinessSearcher._parse_geometry("not a geometry", ("LineString",))
+
+
+class GeometrySearchTest(TestCase):
+    """
+    Polygon and route corridor searches against the spatially indexed business table.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        for name, lon, lat in [
+            ("On route", -100.0, 40.0),
+            ("Near route", -100.5, 40.005),
+            ("Off route", -100.0, 40.1),
+            ("Past the end", -98.0, 40.0),
+            ("On the diagonal", -105.0, 40.0),
+            ("Far from the diagonal", -115.0, 44.0),
+        ]:
+            Business.objects.create(name=name, city="Testville", state="KS", location=Point(lon, lat, srid=4326))
+
+    def setUp(self):
+        self.searcher = BusinessSearcher()
+
+    def test_polygon(self):
+        polygon = {"type": "Polygon", "coordinates": [[[-101, 39.5], [-99.5, 39.5], [-99.5, 40.5], [-101, 40.5], [-101, 39.5]]]}
+        businesses = self.searcher.find_businesses_in_polygon(polygon)
+        self.assertCountEqual([b.name for b in businesses], ["On route", "Near route", "Off route"])
+        distances = [b.distance_meters.m for b in businesses]
+        self.assertEqual(distances, sorted(distances))
+
+    def test_route_corridor_in_route_order(self):
+        route = {"type": "LineString", "coordinates": [[-101, 40], [-99, 40]]}
+        businesses = self.searcher.find_businesses_along_route(route, 1)
+        self.assertEqual([b.name for b in businesses], ["Near route", "On route"])
+        self.assertLess(businesses[0].distance_meters.m, 1000)
+        self.assertLess(businesses[0].distance_along_route_meters.m, businesses[1].distance_along_route_meters.m)
+
+    def test_long_diagonal_route(self):
+        coords = [[-120, 35], [-90, 45]]
+        # Inside the route's overall bounding box, but hundreds of km from the route itself
+        candidates = bboxes_filter(Business.objects.all(), polyline_bboxes(coords, 50)).values_list("name", flat=True)
+        self.assertIn("On the diagonal", candidates)
+        self.assertNotIn("Far from the diagonal", candidates)
+
+        businesses = self.searcher.find_businesses_along_route({"type": "LineString", "coordinates": coords}, 50)
+        self.assertEqual([b.name for b in businesses], ["On the diagonal"])
+
+    def test_rejects_negative_or_non_finite_buffer(self):
+        for buffer_km in (-1, float("nan"), float("inf")):
+            with self.assertRaises(ValueError):
+                self.searcher.find_businesses_along_route({"type": "LineString", "coordinates": [[0, 0], [1, 1]]}, buffer_km)
+
+    def test_polygon_within_budget(self):
+        polygon = {"type": "Polygon", "coordinates": [[[-101, 39.5], [-99.5, 39.5], [-99.5, 40.5], [-101, 40.5], [-101, 39.5]]]}
+        complete = self.searcher.find_businesses_in_polygon(polygon)
+        businesses, exhausted = self.searcher.find_businesses_in_polygon_within_budget(polygon, SearchBudget(max_rows=2))
+        self.assertEqual(([b.name for b in businesses], exhausted), ([b.name for b in complete[:2]], "rows"))
+        self.assertEqual(
+            self.searcher.find_businesses_in_polygon_within_budget(polygon, SearchBudget(deadline_seconds=-1)),
+            ([], "deadline"),
+        )
+
+    def test_route_within_budget(self):
+        route = {"type": "LineString", "coordinates": [[-101, 40], [-99, 40]]}
+        businesses, exhausted = self.searcher.find_businesses_along_route_within_budget(route, 1, SearchBudget(max_rows=1))
+        self.assertEqual(([b.name for b in businesses], exhausted), (["Near route"], "rows"))
+        self.assertEqual(
+            self.searcher.find_businesses_along_route_within_budget(route, 1, SearchBudget(deadline_seconds=-1)),
+            ([], "deadline"),
+        )
+
+    @override_settings(SEARCH_MAX_ROWS=1)
+    def test_partial_geometry_response(self):
+        route = '{"type": "LineString", "coordinates": [[-101, 40], [-99, 40]]}'
+        response = self.client.get("/query/", {"route": route, "buffer_km": 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((len(response.data["results"]), response.data["partial"], response.data["budget_exhausted"]), (1, True, "rows"))
+        self.assertEqual(self.client.get("/query/", {"route": route, "buffer_km": "nan"}).status_code, 400)
+
+
+@override_settings(CITY_NEAREST_K=2)
+class CityCentroidTest(TestCase):
+    """
+    The materialized nearest businesses per city centroid, and the searches answered from them.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        for name, city, state, lon, lat in [
+            ("Alpha 1", "Alpha", "KS", -100.0, 40.0),
+            ("Alpha 2", "Alpha", "KS", -100.01, 40.0),
+            ("Alpha 3", "Alpha", "KS", -100.03, 40.0),
+            ("Beta 1", "Beta", "NE", -96.0, 41.0),
+            ("Beta 2", "Beta", "NE", -96.01, 41.0),
+            # Alone, so its second nearest business is hundreds of km away
+            ("Gamma 1", "Gamma", "CO", -105.0, 39.7),
+        ]:
+            Business.objects.create(name=name, city=city, state=state, location=Point(lon, lat, srid=4326))
+        centroids.refresh_city_centroids()
+
+    def _nearest_names(self, city):
+        centroid, businesses = centroids.nearest_to_city_center(city, CityCentroid.objects.get(city=city).state)
+        return [business.name for business in businesses]
+
+    def test_nearest_matches_brute_force(self):
+        businesses = list(Business.objects.all())
+        for centroid in CityCentroid.objects.all():
+            expected = sorted(
+                businesses,
+                key=lambda b: spherical_distance_m(centroid.location.y, centroid.location.x, b.location.y, b.location.x),
+            )[:2]
+            self.assertEqual(self._nearest_names(centroid.city), [b.name for b in expected])
+        self.assertEqual(self._nearest_names("Alpha"), ["Alpha 2", "Alpha 1"])
+        # Found by widening the window well past its starting size
+        self.assertEqual(self._nearest_names("Gamma"), ["Gamma 1", "Alpha 3"])
+
+    def test_cities_affected_by(self):
+        alpha = CityCentroid.objects.get(city="Alpha")
+        affected = centroids._cities_affected_by([(alpha.location.y, alpha.location.x)], 2)
+        self.assertIn(("Alpha", "KS"), affected)
+        self.assertNotIn(("Beta", "NE"), affected)
+
+        self.assertEqual(centroids._cities_affected_by([(0.0, 0.0)], 2), set())
+        # Lists that aren't full yet take any new business
+        self.assertEqual(
+            centroids._cities_affected_by([(0.0, 0.0)], 3),
+            {("Alpha", "KS"), ("Beta", "NE"), ("Gamma", "CO")},
+        )
+
+        with mock.patch.object(centroids, "MAX_INCREMENTAL_COMPARISONS", 1):
+            self.assertIsNone(centroids._cities_affected_by([(0.0, 0.0), (1.0, 1.0)], 2))
+
+    def test_radius_search_at_a_centroid(self):
+        alpha = CityCentroid.objects.get(city="Alpha")
+        lat, lon = alpha.location.y, alpha.location.x
+
+        businesses = centroids.businesses_within_radius_of_centroid(lat, lon, 1)
+        self.assertEqual([b.name for b in businesses], ["Alpha 2"])
+        self.assertLess(businesses[0].distance_meters.m, 1000)
+
+        # Past the k-th nearest distance the table may be missing businesses, so it doesn't answer
+        self.assertIsNone(centroids.businesses_within_radius_of_centroid(lat, lon, 2))
+        # Not centered on a centroid
+        self.assertIsNone(centroids.businesses_within_radius_of_centroid(lat + 0.001, lon, 1))
+
+    def test_walk_looks_the_centroid_up_once(self):
+        alpha = CityCentroid.objects.get(city="Alpha")
+        for lat in (alpha.location.y, alpha.location.y + 0.001):
+            with mock.patch.object(centroids, "centroid_at", wraps=centroids.centroid_at) as centroid_at:
+                # Nothing within any radius, so the walk tries every one of them
+                searcher = BusinessSearcher(radius_increments_km=[0.001, 0.002, 0.003])
+                self.assertEqual(searcher.find_businesses_incrementally(lat, alpha.location.x, 0), (0, []))
+            self.assertEqual(centroid_at.call_count, 1)
+
+    def test_lookup_skips_the_query_away_from_centroids(self):
+        alpha = CityCentroid.objects.get(city="Alpha")
+        centroids.invalidate_centroid_hint()
+        self.assertTrue(centroids.is_centroid(alpha.location.y, alpha.location.x))
+        with self.assertNumQueries(0):
+            self.assertFalse(centroids.is_centroid(alpha.location.y + 0.001, alpha.location.x))
+
+        # Refreshing in this process updates the in-memory coordinates right away
+        Business.objects.create(name="Delta 1", city="Delta", state="KS", location=Point(-99.0, 38.0, srid=4326))
+        centroids.refresh_city_centroids({("Delta", "KS")}, [(38.0, -99.0)])
+        self.assertTrue(centroids.is_centroid(38.0, -99.0))
+
+    def test_incremental_refresh(self):
+        Business.objects.create(name="Beta 3", city="Beta", state="NE", location=Point(-96.005, 41.0, srid=4326))
+        refreshed = centroids.refresh_city_centroids({("Beta", "NE")}, [(41.0, -96.005)])
+        self.assertGreaterEqual(refreshed, 1)
+        self.assertEqual(self._nearest_names("Beta")[0], "Beta 3")
+        self.assertEqual(CityCentroid.objects.get(city="Beta").business_count, 3)
+
+
+@override_settings(CITY_NEAREST_K=10)
+class CombinedSearchTest(TestCase):
+    """
+    City/state and radius searches combined into one result, deduped and ordered by distance.
+    """
+    CENTER = (40.0, -100.0)
+
+    @classmethod
+    def setUpTestData(cls):
+        lat, lon = cls.CENTER
+        for name, city, state, (business_lat, business_lon) in [
+            ("Center", "Hays", "KS", (lat, lon)),
+            ("Near", "Other", "KS", _destination(lat, lon, 90, 500)),
+            ("Same spot B", "Other", "NE", _destination(lat, lon, 0, 700)),
+            ("Same spot A", "Other", "NE", _destination(lat, lon, 0, 700)),
+            ("Hays far", "Hays", "KS", _destination(lat, lon, 0, 300000)),
+        ]:
+            Business.objects.create(name=name, city=city, state=state, location=Point(business_lon, business_lat, srid=4326))
+
+    def setUp(self):
+        self.searcher = BusinessSearcher()
+
+    def _summary(self, result):
+        radius_km, businesses, exhausted = result
+        return radius_km, [(b.name, b.match_reason) for b in businesses], exhausted
+
+    def test_match_reasons_and_order(self):
+        result = self.searcher.find_businesses_combined(*self.CENTER, 1, "Hays", "KS", SearchBudget())
+        self.assertEqual(self._summary(result), (1, [
+            ("Center", "both"),
+            ("Near", "radius"),
+            # Same distance, so by name
+            ("Same spot A", "radius"),
+            ("Same spot B", "radius"),
+            ("Hays far", "city_state"),
+        ], None))
+        distances = [b.distance_meters.m for b in result[1]]
+        self.assertEqual(distances, sorted(distances))
+        self.assertAlmostEqual(distances[-1], 300000, delta=1000)
+
+    def test_chosen_radius(self):
+        # Nothing within 2 or 3 km, the walk stops at 2 + 5 km like the incremental search does
+        lat, lon = _destination(*self.CENTER, 180, 4000)
+        radius_km, businesses, exhausted = self.searcher.find_businesses_combined(lat, lon, 2, None, None, SearchBudget())
+        self.assertEqual((radius_km, exhausted), (7, None))
+        self.assertEqual([b.name for b in businesses], ["Center", "Near", "Same spot A", "Same spot B"])
+        incremental_radius_km, incremental = self.searcher.find_businesses_incrementally(lat, lon, 2)
+        self.assertEqual((radius_km, {b.pk for b in businesses}), (incremental_radius_km, {b.pk for b in incremental}))
+
+    def test_city_state_only(self):
+        result = self.searcher.find_businesses_combined(None, None, 0, "Other", "NE", SearchBudget())
+        self.assertEqual(self._summary(result), (0, [("Same spot A", "city_state"), ("Same spot B", "city_state")], None))
+        self.assertIsNone(result[1][0].distance_meters)
+
+    def test_rows_budget(self):
+        result = self.searcher.find_businesses_combined(*self.CENTER, 1, "Hays", "KS", SearchBudget(max_rows=2))
+        self.assertEqual(self._summary(result), (1, [("Center", "both"), ("Near", "radius")], "rows"))
+
+    def test_centered_on_a_centroid(self):
+        centroids.refresh_city_centroids()
+        near = Business.objects.get(name="Near").location
+        with mock.patch.object(centroids, "is_centroid", return_value=False):
+            expected = self._summary(self.searcher.find_businesses_combined(near.y, near.x, 1, "Hays", "KS", SearchBudget()))
+
+        # Read from the centroid table and merged, instead of through the combined statement
+        with mock.patch.object(BusinessSearcher, "_compile_combined_query", side_effect=AssertionError):
+            result = self.searcher.find_businesses_combined(near.y, near.x, 1, "Hays", "KS", SearchBudget())
+        self.assertEqual(self._summary(result), expected)
+        self.assertEqual(expected[1][0], ("Near", "radius"))
+
+
+class SingleFlightTest(SimpleTestCase):
+    """
+    Concurrent calls with the same key run once and share the outcome.
+    """
+
+    def _start_leader(self, flight, key, release, outcome):
+        started = threading.Event()
+
+        def fn():
+            started.set()
+            release.wait(5)
+            if isinstance(outcome, BaseException):
+                raise outcome
+            return outcome
+
+        results = []
+        thread = threading.Thread(target=self._call, args=(flight, key, fn, results))
+        thread.start()
+        self.assertTrue(started.wait(5))
+        return thread, results
+
+    def _start_waiters(self, flight, key, count, timeout=None):
+        threads, results = [], []
+        for _ in range(count):
+            thread = threading.Thread(target=self._call, args=(flight, key, self._never_called, results, timeout))
+            thread.start()
+            threads.append(thread)
+        # Only release the leader once every waiter joined its call
+        stop = time.monotonic() + 5
+        while flight.stats()["waiting"] < count and time.monotonic() < stop:
+            time.sleep(0.001)
+        self.assertEqual(flight.stats()["waiting"], count)
+        return threads, results
+
+    def _call(self, flight, key, fn, results, timeout=None):
+        try:
+            results.append(("result", flight.do(key, fn, timeout=timeout)))
+        except BaseException as e:
+            results.append(("error", e))
+
+    def _never_called(self):
+        raise AssertionError("A waiter ran its own call")
+
+    def test_shares_result(self):
+        flight, release = SingleFlight(), threading.Event()
+        result = ["shared"]
+        leader, leader_results = self._start_leader(flight, "key", release, result)
+        waiters, waiter_results = self._start_waiters(flight, "key", 4)
+        release.set()
+        for thread in [leader, *waiters]:
+            thread.join(5)
+
+        self.assertEqual(leader_results, [("result", result)])
+        self.assertEqual(len(waiter_results), 4)
+        for kind, value in waiter_results:
+            self.assertEqual(kind, "result")
+            self.assertIs(value, result)
+        self.assertEqual(
+            flight.stats(),
+            {"executions": 1, "coalesced": 4, "timeouts": 0, "errors": 0, "in_flight": 0, "waiting": 0},
+        )
+
+    def test_different_keys_and_later_calls_run_again(self):
+        flight = SingleFlight()
+        self.assertEqual(flight.do("a", lambda: 1), 1)
+        self.assertEqual(flight.do("b", lambda: 2), 2)
+        self.assertEqual(flight.do("a", lambda: 3), 3)
+        self.assertEqual(flight.stats()["executions"], 3)
+        self.assertEqual(flight.stats()["coalesced"], 0)
+
+    def test_error_reaches_every_waiter(self):
+        flight, release = SingleFlight(), threading.Event()
+        error = Overloaded("busy", 503, 7)
+        leader, leader_results = self._start_leader(flight, "key", release, error)
+        waiters, waiter_results = self._start_waiters(flight, "key", 3)
+        release.set()
+        for thread in [leader, *waiters]:
+            thread.join(5)
+
+        self.assertEqual(leader_results, [("error", error)])
+        self.assertEqual(len(waiter_results), 3)
+        raised = [value for _, value in waiter_results]
+        for kind, value in waiter_results:
+            self.assertEqual(kind, "error")
+            # Each waiter raises its own copy, keeping the type and attributes, chained to the original
+            self.assertIsInstance(value, Overloaded)
+            self.assertIsNot(value, error)
+            self.assertIs(value.__cause__, error)
+            self.assertEqual((str(value), value.status_code, value.retry_after), ("busy", 503, 7))
+        self.assertEqual(len({id(value) for value in raised}), 3)
+        stats = flight.stats()
+        self.assertEqual((stats["executions"], stats["coalesced"], stats["errors"]), (1, 3, 1))
+
+    def test_waiter_timeout(self):
+        flight, release = SingleFlight(), threading.Event()
+        leader, leader_results = self._start_leader(flight, "key", release, "late")
+        waiters, waiter_results = self._start_waiters(flight, "key", 1, timeout=0.01)
+        waiters[0].join(5)
+
+        self.assertEqual(len(waiter_results), 1)
+        self.assertIsInstance(waiter_results[0][1], SingleFlightTimeout)
+        self.assertEqual(flight.stats()["waiting"], 0)
+        self.assertEqual(flight.stats()["in_flight"], 1)
+
+        release.set()
+        leader.join(5)
+        self.assertEqual(leader_results, [("result", "late")])
+        stats = flight.stats()
+        self.assertEqual((stats["executions"], stats["coalesced"], stats["timeouts"]), (1, 0, 1))
+
+
+class AdmissionControllerTest(SimpleTestCase):
+    """
+    Searches beyond the concurrency limit queue up to a point, then get turned away with a Retry-After.
+    """
+
+    def _controller(self, max_queued=1, queue_timeout=0.01):
+        return AdmissionController(
+            limits={RADIUS: 1, CITY_STATE: 1},
+            max_queued={RADIUS: max_queued, CITY_STATE: max_queued},
+            queue_timeout=queue_timeout,
+            retry_after=7,
+        )
+
+    def test_queue_full_is_429(self):
+        controller = self._controller(max_queued=0)
+        with controller.admit(RADIUS):
+            with self.assertRaises(Overloaded) as raised:
+                with controller.admit(RADIUS):
+                    pass
+        self.assertEqual((raised.exception.status_code, raised.exception.retry_after), (429, 7))
+        self.assertEqual(
+            controller.stats()[RADIUS], {"admitted": 1, "rejected_queue_full": 1, "rejected_timeout": 0, "queued": 0}
+        )
+
+    def test_queue_timeout_is_503(self):
+        controller = self._controller()
+        with controller.admit(RADIUS):
+            with self.assertRaises(Overloaded) as raised:
+                with controller.admit(RADIUS):
+                    pass
+        self.assertEqual((raised.exception.status_code, raised.exception.retry_after), (503, 7))
+        self.assertEqual(
+            controller.stats()[RADIUS], {"admitted": 1, "rejected_queue_full": 0, "rejected_timeout": 1, "queued": 0}
+        )
+
+    def test_queued_search_gets_the_freed_slot(self):
+        controller = self._controller(queue_timeout=5)
+        admitted = threading.Event()
+
+        def queued():
+            with controller.admit(RADIUS):
+                admitted.set()
+
+        with controller.admit(RADIUS):
+            thread = threading.Thread(target=queued)
+            thread.start()
+            stop = time.monotonic() + 5
+            while controller.stats()[RADIUS]["queued"] < 1 and time.monotonic() < stop:
+                time.sleep(0.001)
+            self.assertEqual(controller.stats()[RADIUS]["queued"], 1)
+            self.assertFalse(admitted.is_set())
+        thread.join(5)
+        self.assertTrue(admitted.is_set())
+        self.assertEqual(controller.stats()[RADIUS]["admitted"], 2)
+
+    def test_work_classes_are_independent(self):
+        controller = self._controller(max_queued=0)
+        with controller.admit(RADIUS):
+            with controller.admit(CITY_STATE):
+                pass
+        self.assertEqual(controller.stats()[CITY_STATE]["admitted"], 1)
+
+
+class SearchBudgetTest(SimpleTestCase):
+
+    def test_hashable(self):
+        self.assertEqual(hash(SearchBudget(3, 10, 1.0)), hash(SearchBudget(3, 10, 1.0)))
+        self.assertEqual(len({SearchBudget(3, 10, 1.0), SearchBudget(3, 10, 1.0), SearchBudget()}), 2)
+
+    def test_deadline(self):
+        self.assertIsNone(SearchBudget().deadline())
+        before = time.monotonic()
+        deadline = SearchBudget(deadline_seconds=2).deadline()
+        self.assertTrue(before + 2 <= deadline <= time.monotonic() + 2)
+
+    @override_settings(SEARCH_MAX_EXPANSIONS=2, SEARCH_MAX_ROWS=50, SEARCH_DEADLINE_SECONDS=1.5)
+    def test_from_settings(self):
+        self.assertEqual(SearchBudget.from_settings(), SearchBudget(2, 50, 1.5))
+
+
+class SearchBudgetLimitTest(TestCase):
+    """
+    A radius search that runs out of budget returns what it has and says which limit it hit.
+    """
+    # Counts to ten million, far longer than the deadline checks let it run
+    LONG_QUERY = "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < %s) SELECT COUNT(*) FROM c"
+
+    @classmethod
+    def setUpTestData(cls):
+        for name, lon, lat in [("First", -100.0, 40.0), ("Second", -100.001, 40.0)]:
+            Business.objects.create(name=name, city="Testville", state="KS", location=Point(lon, lat, srid=4326))
+
+    def setUp(self):
+        self.searcher = BusinessSearcher()
+
+    def test_query_deadline_interrupts(self):
+        with self.assertRaises(OperationalError):
+            with transaction.atomic(), query_deadline(time.monotonic() - 1):
+                with connection.cursor() as cursor:
+                    cursor.execute(self.LONG_QUERY, [10 ** 7])
+        # The progress handler is gone once the block exits
+        with connection.cursor() as cursor:
+            cursor.execute(self.LONG_QUERY, [10 ** 5])
+            self.assertEqual(cursor.fetchone(), (10 ** 5,))
+
+    def test_completed(self):
+        radius_km, businesses, exhausted = self.searcher.find_businesses_incrementally_within_budget(
+            40.0, -100.0, 1, SearchBudget(max_expansions=3, max_rows=10)
+        )
+        self.assertEqual((radius_km, len(businesses), exhausted), (1, 2, None))
+
+    def test_out_of_expansions(self):
+        # Nothing within 1 km or 2 km (the first two radii of the walk) of a point 300 km away
+        self.assertEqual(
+            self.searcher.find_businesses_incrementally_within_budget(40.0, -96.5, 1, SearchBudget(max_expansions=2)),
+            (0, [], "expansions"),
+        )
+
+    def test_out_of_rows(self):
+        radius_km, businesses, exhausted = self.searcher.find_businesses_incrementally_within_budget(
+            40.0, -100.0, 1, SearchBudget(max_rows=1)
+        )
+        self.assertEqual(([b.name for b in businesses], exhausted), (["First"], "rows"))
+
+    def test_out_of_time(self):
+        self.assertEqual(
+            self.searcher.find_businesses_incrementally_within_budget(40.0, -100.0, 1, SearchBudget(deadline_seconds=0)),
+            (0, [], "deadline"),
+        )
+
+    @override_settings(SEARCH_MAX_ROWS=1)
+    def test_partial_response(self):
+        response = self.client.get("/query/", {"lat": 40.0, "lon": -100.0, "radius_km": 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data["partial"], response.data["budget_exhausted"]), (True, "rows"))
+        self.assertEqual(len(response.data["results"]), 1)
+
+    def test_complete_response(self):
+        response = self.client.get("/query/", {"lat": 40.0, "lon": -100.0, "radius_km": 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data["partial"], response.data["budget_exhausted"]), (False, None))
+        self.assertEqual(len(response.data["results"]), 2)
+
+
+class GeohashTest(SimpleTestCase):
+
+    def test_encode(self):
+        # The example from the geohash Wikipedia article
+        self.assertEqual(geohash.encode(42.6, -5.6, 5), "ezs42")
+        self.assertEqual(geohash.encode(42.6, -5.6, 2), "ez")
+
+    def test_bounds_contain_the_point(self):
+        for lat, lon in [(42.6, -5.6), (-33.9, 151.2), (89.9, 179.9), (-90.0, -180.0), (0.0, 0.0)]:
+            for precision in range(1, 9):
+                south, west, north, east = geohash.bounds(geohash.encode(lat, lon, precision))
+                self.assertTrue(south <= lat <= north and west <= lon <= east)
+                self.assertEqual((north - south, east - west), geohash.cell_size(precision))
+
+    def test_cell_size(self):
+        self.assertEqual(geohash.cell_size(1), (45.0, 45.0))
+        self.assertEqual(geohash.cell_size(2), (5.625, 11.25))
+
+
+@override_settings(DENSITY_RESOLUTIONS=[2, 4], DENSITY_BREAKDOWNS=["state", "city"])
+class DensityTest(TestCase):
+    """
+    Density cells stay in step with the businesses, and /heatmap reads them by bounding box.
+    """
+    BUSINESSES = [
+        ("One", "Wichita", "KS", -97.3, 37.7),
+        ("Two", "Wichita", "KS", -97.31, 37.69),
+        ("Three", "Topeka", "KS", -95.7, 39.05),
+        ("Four", "Honolulu", "HI", -157.8, 21.3),
+        ("Five", "Suva", "", 178.4, -18.1),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        for name, city, state, lon, lat in cls.BUSINESSES:
+            Business.objects.create(name=name, city=city, state=state, location=Point(lon, lat, srid=4326))
+
+    def _counts(self):
+        return {
+            (cell.resolution, cell.cell, cell.state, cell.city): cell.count
+            for cell in DensityCell.objects.all()
+        }
+
+    def test_full_refresh(self):
+        density.refresh_density_cells()
+        counts = self._counts()
+        wichita = geohash.encode(37.7, -97.3, 4)
+        self.assertEqual(counts[(4, wichita, "", "")], 2)
+        self.assertEqual(counts[(4, wichita, "KS", "")], 2)
+        self.assertEqual(counts[(4, wichita, "KS", "Wichita")], 2)
+        # No breakdown rows for a business without a state
+        suva = geohash.encode(-18.1, 178.4, 2)
+        self.assertEqual([key for key in counts if key[1] == suva], [(2, suva, "", "")])
+        self.assertEqual(sum(count for (resolution, _, state, _), count in counts.items() if resolution == 2 and not state), 5)
+
+    def test_incremental_refresh_matches_full(self):
+        density.refresh_density_cells()
+        added = Business.objects.create(name="Six", city="Topeka", state="KS", location=Point(-95.69, 39.04, srid=4326))
+        Business.objects.filter(name="Four").delete()
+        density.refresh_density_cells(
+            added=[(added.location.y, added.location.x, added.city, added.state)],
+            removed=[(21.3, -157.8, "Honolulu", "HI")],
+        )
+        incremental = self._counts()
+
+        density.refresh_density_cells()
+        self.assertEqual(incremental, self._counts())
+        self.assertFalse(DensityCell.objects.filter(state="HI").exists())
+
+    def test_cells_in_bbox(self):
+        density.refresh_density_cells()
+        kansas = density.cells_in_bbox((-102.0, 37.0, -94.6, 40.0), 4)
+        self.assertEqual(sum(cell.count for cell in kansas), 3)
+        wichita = density.cells_in_bbox((-102.0, 37.0, -94.6, 40.0), 4, "KS", "Wichita")
+        self.assertEqual([cell.count for cell in wichita], [2])
+
+    def test_cells_in_bbox_across_the_antimeridian(self):
+        density.refresh_density_cells()
+        cells = density.cells_in_bbox((170.0, -30.0, -150.0, 30.0), 2)
+        self.assertEqual(sorted(cell.count for cell in cells), [1, 1])
+        with self.assertRaises(ValueError):
+            density.cells_in_bbox((-102.0, 40.0, -94.6, 37.0), 2)
+
+    def test_heatmap(self):
+        density.refresh_density_cells()
+        response = self.client.get("/heatmap/", {"bbox": "-102,37,-94.6,40", "resolution": 4, "state": "KS"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["resolution"], 4)
+        self.assertEqual(sum(cell["count"] for cell in response.data["cells"]), 3)
+        self.assertFalse(response.data["truncated"])
+        west, south, east, north = response.data["cells"][0]["bounds"]
+        self.assertEqual((north - south, east - west), geohash.cell_size(4))
+
+    @override_settings(HEATMAP_MAX_CELLS=1)
+    def test_heatmap_truncated(self):
+        density.refresh_density_cells()
+        response = self.client.get("/heatmap/", {"bbox": "-180,-90,180,90", "resolution": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["cells"]), 1)
+        self.assertTrue(response.data["truncated"])
+
+    def test_heatmap_bad_requests(self):
+        for params in [
+            {"bbox": "-102,37,-94.6"},
+            {"bbox": "-102,40,-94.6,37"},
+            {"bbox": "-102,37,-94.6,40", "resolution": 3},
+            {"bbox": "-102,37,-94.6,40", "city": "Wichita"},
+        ]:
+            self.assertEqual(self.client.get("/heatmap/", params).status_code, 400, msg=params)
+
+
+class ReloadTest(TransactionTestCase):
+    """
+    Zero-downtime reloads through a shadow table. A TransactionTestCase, since SQLite's schema editor can't run
+    inside the transaction a TestCase wraps every test in.
+    """
+
+    def setUp(self):
+        Business.objects.create(name="Old", city="Wichita", state="KS", location=Point(-97.3, 37.7, srid=4326))
+        self.rows = [
+            (f"New {i}", "Topeka", "KS", Point(-95.7 + i / 1000, 39.05, srid=4326))
+            for i in range(5)
+        ]
+
+    def _tables(self):
+        return connection.introspection.table_names()
+
+    def _index_names(self):
+        with connection.cursor() as cursor:
+            return set(connection.introspection.get_constraints(cursor, Business._meta.db_table))
+
+    def test_build_shadow(self):
+        shadow = reload.build_shadow(DEFAULT_DB_ALIAS, self.rows)
+        table = shadow._meta.db_table
+        self.assertTrue(table.startswith(Business._meta.db_table + reload.SHADOW_TABLE_INFIX))
+        self.assertEqual(sorted(shadow.objects.values_list("name", flat=True)), [row[0] for row in self.rows])
+        # The live table is untouched
+        self.assertEqual(list(Business.objects.values_list("name", flat=True)), ["Old"])
+
+        self.assertEqual(reload.drop_leftover_shadows(DEFAULT_DB_ALIAS), [table])
+        self.assertNotIn(table, self._tables())
+        self.assertEqual(reload.drop_leftover_shadows(DEFAULT_DB_ALIAS), [])
+
+    def test_build_shadow_check_fails(self):
+        # Count the live table's spatial index (1 row) instead of the shadow's (5 rows)
+        with mock.patch.object(reload, "index_table", return_value=index_table(Business)):
+            with self.assertRaises(ValueError):
+                reload.build_shadow(DEFAULT_DB_ALIAS, self.rows)
+        self.assertEqual(reload.drop_leftover_shadows(DEFAULT_DB_ALIAS), [])
+
+    def test_swap_in(self):
+        centroids.refresh_city_centroids()
+        tables = set(self._tables())
+        reload.swap_in(DEFAULT_DB_ALIAS, reload.build_shadow(DEFAULT_DB_ALIAS, self.rows))
+
+        self.assertEqual(set(self._tables()), tables)
+        self.assertEqual(sorted(Business.objects.values_list("name", flat=True)), [row[0] for row in self.rows])
+        # The spatial index came along
+        found = BusinessSearcher()._find_businesses_within_radius(39.05, -95.7, 1)
+        self.assertEqual([b.name for b in found], ["New 0", "New 1", "New 2", "New 3", "New 4"])
+        # Its rows pointed at the old table
+        self.assertFalse(CityCentroid.objects.exists())
+
+        # Indexes keep their shadow derived names until migrations need them back
+        canonical = {index.name for index in Business._meta.indexes}
+        swapped_names = self._index_names()
+        self.assertFalse(canonical & swapped_names)
+        self.assertEqual(sorted(reload.restore_index_names(DEFAULT_DB_ALIAS)), sorted(canonical))
+        # Each shadow named index replaced by its migration named one
+        self.assertEqual(self._index_names() - swapped_names, canonical)
+        self.assertEqual(len(swapped_names - self._index_names()), len(canonical))
+        self.assertEqual(reload.restore_index_names(DEFAULT_DB_ALIAS), [])
+
+    def test_reload_businesses(self):
+        self.assertEqual(reload.reload_businesses(self.rows), {DEFAULT_DB_ALIAS: 5})
+        self.assertEqual(Business.objects.count(), 5)
+        self.assertEqual(CityCentroid.objects.get().city, "Topeka")
+
+        with self.assertRaises(ValueError):
+            reload.reload_businesses([])
+        self.assertEqual(Business.objects.count(), 5)
+
+
+class BusinessAdminTest(TestCase):
+    CHANGELIST_URL = "/admin/search/business/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser("admin", "admin@example.com", "password")
+        for name, lon in [("One", -97.3), ("Two", -97.31), ("Three", -97.32)]:
+            Business.objects.create(name=name, city="Wichita", state="KS", location=Point(lon, 37.7, srid=4326))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        centroids.refresh_city_centroids()
+        density.refresh_density_cells()
+
+    def _delete(self, names):
+        pks = Business.objects.filter(name__in=names).values_list("pk", flat=True)
+        return self.client.post(
+            self.CHANGELIST_URL, {"action": "delete_selected_businesses", "_selected_action": list(pks)}, follow=True
+        )
+
+    def test_changelist(self):
+        response = self.client.get(self.CHANGELIST_URL, {"q": "T"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(b.name for b in response.context["cl"].result_list), ["Three", "Two"])
+
+    def test_delete_selected(self):
+        response = self._delete(["One", "Two"])
+        self.assertContains(response, "Deleted 2 businesses.")
+        self.assertEqual(list(Business.objects.values_list("name", flat=True)), ["Three"])
+        self.assertEqual(CityCentroid.objects.get().business_count, 1)
+
+    def _assert_materialized_tables_fresh(self):
+        def snapshot():
+            return (
+                {
+                    (centroid.city, centroid.state):
+                        (centroid.business_count, list(centroid.nearest.order_by("rank").values_list("business_id", flat=True)))
+                    for centroid in CityCentroid.objects.all()
+                },
+                set(DensityCell.objects.values_list("resolution", "cell", "state", "city", "count")),
+            )
+
+        incremental = snapshot()
+        centroids.refresh_city_centroids()
+        density.refresh_density_cells()
+        self.assertEqual(incremental, snapshot())
+
+    def test_add(self):
+        response = self.client.post(
+            self.CHANGELIST_URL + "add/",
+            {"name": "Four", "city": "Topeka", "state": "KS", "location": "SRID=4326;POINT(-95.69 39.04)"},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(CityCentroid.objects.get(city="Topeka").business_count, 1)
+        self._assert_materialized_tables_fresh()
+
+    def test_change(self):
+        one = Business.objects.get(name="One")
+        response = self.client.post(
+            f"{self.CHANGELIST_URL}{one.pk}/change/",
+            {"name": "One", "city": "Topeka", "state": "KS", "location": "SRID=4326;POINT(-95.69 39.04)"},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(CityCentroid.objects.get(city="Wichita").business_count, 2)
+        self._assert_materialized_tables_fresh()
+
+    def test_delete(self):
+        one = Business.objects.get(name="One")
+        response = self.client.post(f"{self.CHANGELIST_URL}{one.pk}/delete/", {"post": "yes"})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(CityCentroid.objects.get(city="Wichita").business_count, 2)
+        self._assert_materialized_tables_fresh()
+
+    @mock.patch.object(admin, "MAX_DELETED_ROWS", 2)
+    def test_delete_selected_refuses_big_selections(self):
+        response = self._delete(["One", "Two", "Three"])
+        self.assertContains(response, "Select at most 2 businesses")
+        self.assertEqual(Business.objects.count(), 3)
+
+    @override_settings(BUSINESS_SHARDS=TEST_SHARDS)
+    def test_disabled_when_sharded(self):
+        self.assertEqual(self.client.get(self.CHANGELIST_URL).status_code, 403)
+        self.assertNotContains(self.client.get("/admin/"), self.CHANGELIST_URL)
@@ -1,7 +1,7 @@
 from django.urls import path
 from django.views.generic import TemplateView
 
-from search.views import QueryView
+from search.views import HeatmapView, QueryView
 from search.health import HealthCheckView
 
 urlpatterns = [
@@ -16,6 +16,10 @@ urlpatterns = [
     path("query/", QueryView.as_view(), name='query'),
     path("query", QueryView.as_view(), name='query-no-slash'),
     
+    # Business density per geohash cell
+    path("heatmap/", HeatmapView.as_view(), name='heatmap'),
+    path("heatmap", HeatmapView.as_view(), name='heatmap-no-slash'),
+    
     # Health check endpoint
     path("health/", HealthCheckView.as_view(), name='health'),
     path("health", HealthCheckView.as_view(), name='health-no-slash'),
@@ -1,6 +1,7 @@
 import json
 from typing import Union
 
+from django.conf import settings
 from django.core.serializers import serialize
 from django.db.models import QuerySet
 from django.shortcuts import redirect
@@ -11,9 +12,18 @@ from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 from rest_framework.views import APIView
 
-from search.models import Business
-from search.serializers import BusinessSerializer
-from search.search_helper import BusinessSearcher, find_businesses_incrementally, get_businesses_by_city_state
+from search import density
+from search.admission import Overloaded, SearchBudget
+from search.serializers import BusinessSerializer, PlannedBusinessSerializer
+from search.singleflight import SingleFlightTimeout
+from search.search_helper import (
+    BusinessSearcher,
+    find_businesses_along_route_within_budget,
+    find_businesses_combined,
+    find_businesses_in_polygon_within_budget,
+    find_businesses_near_city_center,
+    get_businesses_by_city_state,
+)
 
 class QueryView(APIView):
     """
@@ -35,12 +45,27 @@ class QueryView(APIView):
         Optional query parameters:
         - radius_km: Radius in kilometers (int)
         - city: City (string)
+        - near: "center" to get the businesses nearest to the center of city, state instead (both required)
+
+        Alternatively, search by geometry instead (one of):
+        - polygon: GeoJSON Polygon or MultiPolygon (string)
+        - route: GeoJSON LineString (string), with
+          - buffer_km: Max distance from the route in kilometers (float, default 1)
         """
+        polygon = request.query_params.get('polygon')
+        route = request.query_params.get('route')
+        if polygon or route:
+            return self._search_by_geometry(polygon, route, request.query_params.get('buffer_km'))
+
         lat = request.query_params.get('lat')
         lon = request.query_params.get('lon')
         radius_km = request.query_params.get('radius_km', 1)
-        city = request.query_params.get('city')
-        state = request.query_params.get('state')
+        # Normalized so identical searches coalesce (search/singleflight.py)
+        city = (request.query_params.get('city') or '').strip() or None
+        state = (request.query_params.get('state') or '').strip() or None
+
+        if request.query_params.get('near') == 'center':
+            return self._search_near_city_center(city, state)
 
         # Either lat and lon or state are required
         if not ((lat and lon) or state):
@@ -66,23 +91,38 @@ class QueryView(APIView):
             except (ValueError, TypeError):
                 radius_km = 1  # Default to 1km if conversion fails
 
-            # If city+state or state are provided, find business by the given criteria
-            businesses_city_state = get_businesses_by_city_state(city, state)
-            # Find businesses by lat, lon and the supplied search radius or default to 1km
-            radius_km, businesses_lat_lon = find_businesses_incrementally(lat, lon, radius_km)
-            all_businesses = set(businesses_city_state + businesses_lat_lon)
-            
+            budget_exhausted = None
+            if lat and lon:
+                # The city/state and radius searches run as one statement, deduped and ordered by distance
+                # in the database. The radius walk runs within a work budget (search/admission.py) and may come back partial.
+                radius_km, all_businesses, budget_exhausted = find_businesses_combined(
+                    lat, lon, radius_km, city, state, SearchBudget.from_settings()
+                )
+                if budget_exhausted == "deadline" and not all_businesses:
+                    return Response(
+                        {"error": "Search took too long, please retry or narrow it down"},
+                        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        headers={'Retry-After': str(settings.SEARCH_RETRY_AFTER_SECONDS)},
+                    )
+                serializer_class = PlannedBusinessSerializer
+            else:
+                # If city+state or state are provided, find business by the given criteria
+                all_businesses = get_businesses_by_city_state(city, state)
+                radius_km = 0
+                serializer_class = self.serializer_class
+
             # Return the search results
-            serializer = self.serializer_class(all_businesses, many=True)
-            # Build a queryset for GeoJSON serialization
-            business_ids = [b.id for b in all_businesses]
-            queryset = Business.objects.filter(id__in=business_ids)
-            geojson = json.loads(serialize('geojson', queryset))
+            serializer = serializer_class(all_businesses, many=True)
+            # GeoJSON straight from the fetched businesses, re-querying by id would be wrong across shards
+            geojson = json.loads(serialize('geojson', all_businesses))
             return Response({
                 'results': serializer.data,
                 'search_center': {'lat': lat, 'lng': lon},
                 'radius_km': radius_km,
                 'geoJSON': geojson,
+                # Set when the radius search ran out of budget ("expansions", "rows" or "deadline")
+                'partial': budget_exhausted is not None,
+                'budget_exhausted': budget_exhausted,
             }, status=status.HTTP_200_OK)
             
         except ValueError:
@@ -90,8 +130,208 @@ class QueryView(APIView):
                 {"error": "Latitude and longitude must be valid numbers. Same for radius_km if provided."},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        except SingleFlightTimeout as e:
+            return self._coalesce_timeout_response(e)
+        except Overloaded as e:
+            return self._overloaded_response(e)
         except Exception as e:
             return Response(
                 {"error": str(e)}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+    @staticmethod
+    def _coalesce_timeout_response(error: SingleFlightTimeout) -> Response:
+        """
+        An identical search was already running and didn't finish in time. Ask the client to retry.
+        """
+        return Response(
+            {"error": str(error)},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={'Retry-After': '1'},
+        )
+
+    @staticmethod
+    def _overloaded_response(error: Overloaded) -> Response:
+        """
+        Admission control turned the search away. Tell the client when to retry instead of queueing it.
+        """
+        return Response(
+            {"error": str(error)},
+            status=error.status_code,
+            headers={'Retry-After': str(error.retry_after)},
+        )
+
+    def _search_by_geometry(self, polygon: str, route: str, buffer_km: str) -> Response:
+        """
+        Handle polygon and route corridor searches.
+
+        Args:
+            polygon: GeoJSON Polygon or MultiPolygon, or None
+            route: GeoJSON LineString, or None
+            buffer_km: Max distance from the route in kilometers, defaults to 1
+
+        Returns:
+            Response: Results ordered by distance from the polygon centroid, or by position along the route
+        """
+        if polygon and route:
+            return Response(
+                {"error": "Please provide either a polygon or a route, not both"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            # Runs within the same work budget as radius searches (search/admission.py) and may come back partial
+            if polygon:
+                businesses, budget_exhausted = find_businesses_in_polygon_within_budget(polygon, SearchBudget.from_settings())
+            else:
+                buffer_km = float(buffer_km) if buffer_km else 1.0
+                businesses, budget_exhausted = find_businesses_along_route_within_budget(
+                    route, buffer_km, SearchBudget.from_settings()
+                )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except SingleFlightTimeout as e:
+            return self._coalesce_timeout_response(e)
+        except Overloaded as e:
+            return self._overloaded_response(e)
+        except Exception as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        if budget_exhausted == "deadline" and not businesses:
+            return Response(
+                {"error": "Search took too long, please retry or narrow it down"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(settings.SEARCH_RETRY_AFTER_SECONDS)},
+            )
+
+        response_data = {
+            'results': self.serializer_class(businesses, many=True).data,
+            'geoJSON': json.loads(serialize('geojson', businesses)),
+            # Set when the search ran out of budget ("rows" or "deadline")
+            'partial': budget_exhausted is not None,
+            'budget_exhausted': budget_exhausted,
+        }
+        if route:
+            response_data['buffer_km'] = buffer_km
+            # Lines up with 'results', which are in the order they appear along the route
+            response_data['distance_along_route_km'] = [
+                round(business.distance_along_route_meters.km, 3) for business in businesses
+            ]
+        return Response(response_data, status=status.HTTP_200_OK)
+
+    def _search_near_city_center(self, city: str, state: str) -> Response:
+        """
+        Handle "near the center of <city>" searches, served from the materialized nearest table.
+
+        Args:
+            city: City name
+            state: State code
+
+        Returns:
+            Response: The nearest businesses to the city center, nearest first
+        """
+        if not (city and state):
+            return Response(
+                {"error": "Please provide both city and state with near=center"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            center, businesses = find_businesses_near_city_center(city, state)
+        except SingleFlightTimeout as e:
+            return self._coalesce_timeout_response(e)
+        except Overloaded as e:
+            return self._overloaded_response(e)
+        except Exception as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        return Response({
+            'results': self.serializer_class(businesses, many=True).data,
+            'search_center': {'lat': center.y, 'lng': center.x} if center else None,
+            'geoJSON': json.loads(serialize('geojson', businesses)),
+        }, status=status.HTTP_200_OK)
+
+
+class HeatmapView(APIView):
+    """
+    API endpoint returning precomputed business counts per geohash cell, for low zoom map views.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        """
+        Handle GET requests for the density cells intersecting a bounding box.
+
+        Required query parameters:
+        - bbox: min_lon,min_lat,max_lon,max_lat (floats). min_lon > max_lon for a box crossing the antimeridian.
+
+        Optional query parameters:
+        - resolution: Geohash resolution (int, defaults to the middle configured resolution)
+        - state: Only count businesses in this state (string)
+        - city: Only count businesses in this city, needs state (string)
+        """
+        resolutions = settings.DENSITY_RESOLUTIONS
+        try:
+            bbox = tuple(float(value) for value in request.query_params.get('bbox', '').split(','))
+            if len(bbox) != 4:
+                raise ValueError
+        except ValueError:
+            return Response(
+                {"error": "Please provide bbox as min_lon,min_lat,max_lon,max_lat"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            resolution = int(request.query_params.get('resolution') or resolutions[len(resolutions) // 2])
+        except ValueError:
+            resolution = None
+        if resolution not in resolutions:
+            return Response(
+                {"error": f"resolution must be one of {resolutions}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        state = (request.query_params.get('state') or '').strip()
+        city = (request.query_params.get('city') or '').strip()
+        if city and not state:
+            return Response(
+                {"error": "Please provide a state along with city"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            # One more than the limit, to tell whether the response got truncated
+            cells = list(density.cells_in_bbox(bbox, resolution, state, city)[:settings.HEATMAP_MAX_CELLS + 1])
+        except ValueError as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except Exception as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        truncated = len(cells) > settings.HEATMAP_MAX_CELLS
+        return Response({
+            'resolution': resolution,
+            'cells': [
+                {
+                    'cell': cell.cell,
+                    'count': cell.count,
+                    'bounds': [cell.west, cell.south, cell.east, cell.north],
+                    'center': {'lat': (cell.south + cell.north) / 2, 'lng': (cell.west + cell.east) / 2},
+                }
+                for cell in cells[:settings.HEATMAP_MAX_CELLS]
+            ],
+            # Set when there were more cells than HEATMAP_MAX_CELLS, use a lower resolution or a smaller bbox
+            'truncated': truncated,
+        }, status=status.HTTP_200_OK)